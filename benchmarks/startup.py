@@ -0,0 +1,58 @@
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+KATTI_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "..")
+
+# subcommands that should start quickly, none of them touch the network
+_commands = [
+  ["--help"],
+  ["--history"],
+  ["--history_size", "-1"],
+  ["-r"]
+]
+
+
+"""
+Times cold starts of katti the way the installed launcher runs it, by importing
+the module so its bytecode is cached
+
+Params: A list of string arguments, an int runs
+Returns: A tuple of the fastest and median wall time in milliseconds
+"""
+def time_command(args, runs):
+  launcher = "import sys; sys.path.insert(0, %r); import katti; katti.main()" % KATTI_DIR
+  times = []
+  # run from an empty directory so -r finds nothing to compile
+  with tempfile.TemporaryDirectory() as directory:
+    for _ in range(runs):
+      start = time.perf_counter()
+      subprocess.run(
+        [sys.executable, "-c", launcher] + args,
+        cwd=directory,
+        stdin=subprocess.DEVNULL,
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.DEVNULL
+      )
+      times.append((time.perf_counter() - start) * 1000)
+  times.sort()
+  return (times[0], times[len(times) // 2])
+
+
+def main():
+  runs = int(sys.argv[1]) if len(sys.argv) > 1 else 10
+  # the interpreter alone is the floor for any command
+  start = time.perf_counter()
+  for _ in range(runs):
+    subprocess.run([sys.executable, "-c", "pass"])
+  print("python startup: %.1f ms" % ((time.perf_counter() - start) * 1000 / runs))
+  print("| %-24s | %10s | %10s |" % ("COMMAND", "MIN (ms)", "MEDIAN (ms)"))
+  for args in _commands:
+    fastest, median = time_command(args, runs)
+    print("| %-24s | %10.1f | %11.1f |" % ("katti " + " ".join(args), fastest, median))
+
+
+if __name__ == "__main__":
+  main()
@@ -0,0 +1,137 @@
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+import katti
+
+# status pages laid out like kattis' submission page, with the page's header,
+# scripts and footer around the submission table
+FIXTURES_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures")
+# what parse_status_page() must find in each of them
+_FIXTURE_RESULTS = {
+  "running.html": {
+    "status": {"running"},
+    "accepted": 5,
+    "runtime": "\xa0",
+    "reason": "",
+    "case_title": "Test case 1/12: Accepted"
+  },
+  "accepted.html": {
+    "status": {"accepted"},
+    "accepted": 20,
+    "runtime": "0.02\xa0s",
+    "reason": "",
+    "case_title": "Test case 1/20: Accepted"
+  },
+  "rejected.html": {
+    "status": {"rejected"},
+    "accepted": 6,
+    "runtime": "0.05\xa0s",
+    "reason": "Wrong Answer",
+    "case_title": "Test case 1/14: Accepted"
+  },
+  "large_grid.html": {
+    "status": {"rejected"},
+    "accepted": 1187,
+    "runtime": ">\xa02.00\xa0s",
+    "reason": "Time Limit Exceeded",
+    "case_title": "Test case 1/1500: Accepted"
+  }
+}
+
+# sample status pages shaped like kattis' submission page, with a grid of test case spans
+_PAGE = """\
+<html><head><title>Submission</title></head><body>
+<table class="table-wide"><tbody><tr>
+<td class="submission_id">1234567</td>
+<td class="status middle"><span class="%s">%s</span></td>
+<td class="runtime middle">0.42&nbsp;s</td>
+<td class="lang middle">C++</td>
+</tr></tbody></table>
+<div class="testcases">%s</div>
+%s
+</body></html>
+"""
+
+
+"""
+Builds a status page with a given number of accepted test cases out of a total
+
+Params: A string status class, an int accepted, an int total
+Returns: A string html page
+"""
+def make_page(status, accepted, total):
+  cases = []
+  for i in range(1, total + 1):
+    if i <= accepted:
+      case_status = "accepted"
+    elif i == accepted + 1 and status == "rejected":
+      case_status = "rejected"
+    else:
+      case_status = "pending"
+    cases.append('<span class="%s" title="Test case %i/%i: %s"></span>' % (case_status, i, total, case_status))
+  reason = '<p><span class="rejected">Wrong Answer</span></p>' if status == "rejected" else ""
+  return _PAGE % (status, status.title(), "".join(cases), reason)
+
+
+"""
+The parse katti did before parse_status_page(), kept as a baseline. Only the
+spans in the test case grid are counted as cases, as parse_status_page() does
+
+Params: A string html page
+Returns: A dict of the same fields parse_status_page() returns
+"""
+def parse_with_soup(html):
+  from bs4 import BeautifulSoup
+  soup = BeautifulSoup(html, "html.parser")
+  status = soup.find("td", class_=re.compile("status"))
+  status = set(status.find_all("span")[0]["class"]) if status else None
+  runtime = soup.find("td", class_=re.compile("runtime"))
+  reason = soup.find("span", class_="rejected")
+  cases = soup.find_all("span", title=re.compile("Test case"))
+  return {
+    "status": status,
+    "accepted": len([c for c in cases if any("accepted" in k for k in c.get("class", []))]),
+    "runtime": runtime.text if runtime else "",
+    "reason": reason.text if reason else "",
+    "case_title": cases[0]["title"] if cases else None
+  }
+
+
+def main():
+  try:
+    import bs4
+  except ImportError:
+    bs4 = None
+  pages = {}
+  for name, expected in _FIXTURE_RESULTS.items():
+    with open(os.path.join(FIXTURES_DIR, name)) as f:
+      pages[name] = f.read()
+    result = katti.parse_status_page(pages[name])
+    if result != expected:
+      print("Wrong parse of %s: %s" % (name, result))
+      sys.exit(1)
+  pages.update({
+    "running, 10 cases": make_page("running", 4, 10),
+    "accepted, 100 cases": make_page("accepted", 100, 100),
+    "rejected, 500 cases": make_page("rejected", 250, 500),
+    "running, 2000 cases": make_page("running", 1500, 2000)
+  })
+  print("| %-22s | %14s | %14s | %8s |" % ("PAGE", "TARGETED (ms)", "SOUP (ms)", "SPEEDUP"))
+  for name, html in pages.items():
+    number = 20
+    targeted = timeit.timeit(lambda: katti.parse_status_page(html), number=number) / number * 1000
+    if bs4 is None:
+      print("| %-22s | %14.3f | %14s | %8s |" % (name, targeted, "n/a", "n/a"))
+      continue
+    if katti.parse_status_page(html) != parse_with_soup(html):
+      print("Parsers disagree on page: %s" % name)
+      sys.exit(1)
+    soup = timeit.timeit(lambda: parse_with_soup(html), number=number) / number * 1000
+    print("| %-22s | %14.3f | %14.3f | %7.1fx |" % (name, targeted, soup, soup / targeted))
+
+
+if __name__ == "__main__":
+  main()
@@ -32,8 +32,11 @@ os.system("mkdir -v /usr/local/opt/katti")
 print("\033[1;34m=> \033[1;32mMoving files to /usr/local/opt/katti...\033[0m")
 os.system("cp -v katti.py /usr/local/opt/katti")
 print("\033[1;34m=> \033[1;32mMaking katti shell script in /usr/local/bin...\033[0m")
-print("echo 'python3 /usr/local/opt/katti/katti.py \"$@\"' > /usr/local/bin/katti")
-os.system("echo 'python3 /usr/local/opt/katti/katti.py \"$@\"' > /usr/local/bin/katti")
+# import katti as a module rather than running it as a script so python caches its bytecode
+launcher = "python3 -c 'import sys; sys.path.insert(0, \"/usr/local/opt/katti\"); import katti; katti.main()' \"$@\"\n"
+print("writing /usr/local/bin/katti: " + launcher, end="")
+with open("/usr/local/bin/katti", "w") as f:
+  f.write(launcher)
 print("chmod +x /usr/local/bin/katti")
 os.system("chmod +x /usr/local/bin/katti")
 print("\033[1;34m=> \033[1;32mMaking katti config directory in /usr/local/etc...\033[0m")
@@ -1,13 +1,19 @@
 import argparse
-from bisect import bisect
-import configparser
+import contextlib
 from datetime import datetime
+import fcntl
+import html
 import json
-import multiprocessing as mp
+import io
 import os
 import random
 import re
+import shutil
+import signal
+import subprocess
 import sys
+import tempfile
+import threading
 import time
 
 # for customization of arg parser
@@ -16,29 +22,36 @@ class Parser(argparse.ArgumentParser):
     if action.choices is not None and value not in action.choices:
       raise argparse.ArgumentError(action, "invalid option")
 
+# raised when kattis returns a page katti can't use
+class KattisError(Exception):
+  def __init__(self, message, status_code=None):
+    super().__init__(message)
+    self.status_code = status_code
+
 # check python version
 if sys.version_info[0] < 3:
   print("Python 3 required")
   print("Aborting...")
   sys.exit(0)
 
-# set of dependencies
-missing_dependencies = {
-  "requests",
-  "beautiful soup"
-}
+# third party dependency, imported by import_requests() for commands that use the network
+requests = None
 
-# import and catch dependency failures
-try:
-  import requests
-  missing_dependencies.remove("requests")
-  from bs4 import BeautifulSoup
-  missing_dependencies.remove("beautiful soup")
-except:
-  for d in missing_dependencies:
-    print("package \"%s\" required" % d)
-  print("Aborting...")
-  sys.exit(0)
+"""
+Imports requests the first time it is needed, so commands that never touch the
+network don't pay for it at startup
+
+Params: None
+Returns: None
+"""
+def import_requests():
+  global requests
+  try:
+    import requests
+  except ImportError:
+    print("package \"requests\" required")
+    print("Aborting...")
+    sys.exit(0)
 
 # global verbose option
 verbose = False
@@ -65,22 +78,108 @@ _LOGIN_URL = "https://open.kattis.com/login"
 _SUBMIT_URL = "https://open.kattis.com/submit"
 _STATUS_URL = "https://open.kattis.com/submissions/"
 
-# maximum number of times to check a submissions status
-MAX_SUBMISSION_CHECKS = 60
+# hours a saved login is reused before logging in again
+LOGIN_LIFETIME = 24
+
+# seconds to wait on a submission's result before giving up on tracking it
+SUBMISSION_TIMEOUT = 300
+# first and longest delays between checks of a submission's status in seconds, and the backoff between them
+POLL_INTERVAL = 0.25
+MAX_POLL_INTERVAL = 5
+POLL_BACKOFF = 1.5
+
+# default number of concurrent requests and requests per second when refreshing ratings
+DEFAULT_REFRESH_WORKERS = 16
+DEFAULT_REFRESH_RATE_LIMIT = 20
+
+# retries of a failed rating request during a refresh, and the base delay between them in seconds
+REFRESH_RETRIES = 4
+REFRESH_BACKOFF = 0.5
+# http statuses worth retrying
+_transient_statuses = {429, 500, 502, 503, 504}
 
 # default size of submission history
 DEFAULT_HIST_SIZE = 100
+# bytes in each fixed size record of the submission history log, newline included
+_HISTORY_RECORD_SIZE = 128
+
+# default limits for local test runs, in seconds and megabytes
+DEFAULT_TIME_LIMIT = 3
+DEFAULT_MEMORY_LIMIT = 1024
+# a case is killed once its wall time exceeds this multiple of the time limit
+WALL_TIME_FACTOR = 2
+# seconds past that katti waits for the launcher to kill and report on a case
+_LAUNCHER_GRACE = 1
+
+# seconds of quiet after a change before --watch reruns, and between checks when polling
+WATCH_DEBOUNCE = 0.1
+WATCH_POLL_INTERVAL = 0.25
+# inotify events that mean a watched file was written, replaced or removed
+_IN_CLOSE_WRITE = 0x8
+_IN_MOVED_FROM = 0x40
+_IN_MOVED_TO = 0x80
+_IN_DELETE = 0x200
+
+# default absolute and relative error allowed when comparing floating point output
+DEFAULT_TOLERANCE = 1e-6
+# ways in which a program's output can be compared to the expected output
+_comparison_modes = {"exact", "whitespace", "float"}
+# outputs are compared in chunks of this many bytes
+_COMPARE_CHUNK_SIZE = 1 << 16
+# bytes of each output kept for displaying failures
+_PREVIEW_SIZE = 1 << 12
+
+# markers left on stderr by programs that run out of memory
+_out_of_memory_markers = (
+  b"MemoryError",
+  b"bad_alloc",
+  b"OutOfMemoryError"
+)
 
 # user config files
 user_conf = None
 problems_conf = None
 USER_CONF_PATH = "/usr/local/etc/katti/config.json"
 PROBLEMS_CONF_PATH = "/usr/local/etc/katti/problem_ids.json"
+CATALOG_PATH = "/usr/local/etc/katti/problems.db"
+REFRESH_CHECKPOINT_PATH = "/usr/local/etc/katti/refresh_checkpoint.json"
+COOKIES_PATH = "/usr/local/etc/katti/cookies.json"
+HISTORY_PATH = "/usr/local/etc/katti/history.log"
 HOME = os.path.expanduser('~')
 ZSH_COMP_PATH = os.path.join(HOME, ".config/zsh/custom_completions/_katti")
-
-# user conf or problems conf modified
+CACHE_DIR = os.path.join(os.getenv("XDG_CACHE_HOME", os.path.join(HOME, ".cache")), "katti")
+BUILD_CACHE_DIR = os.path.join(CACHE_DIR, "builds")
+PAGE_CACHE_PATH = os.path.join(CACHE_DIR, "pages.json")
+MIRROR_DIR = os.path.join(CACHE_DIR, "mirror")
+MIRROR_INDEX_PATH = os.path.join(MIRROR_DIR, "index.json")
+
+# default size of the build cache in megabytes
+DEFAULT_BUILD_CACHE_SIZE = 256
+# default hours a cached problem page is trusted before it is revalidated with kattis
+DEFAULT_PAGE_CACHE_TTL = 1
+# default maximum number of problem pages kept in the page cache
+DEFAULT_PAGE_CACHE_SIZE = 5000
+# default hours a mirrored problem is used before it is fetched from kattis again
+DEFAULT_MIRROR_AGE = 30 * 24
+
+# user conf modified, the problem catalog saves its own changes
 modified = False
+# a copy of the user conf as it was loaded, for working out what changed
+_user_conf_snapshot = {}
+
+# http session shared by every request katti makes, created on first use
+_session = None
+_session_lock = threading.Lock()
+
+# validators and ratings of problem pages, loaded on first use
+_page_cache = None
+_page_cache_modified = False
+_page_cache_lock = threading.Lock()
+
+# ratings and sample archive hashes of mirrored problems, loaded on first use
+_mirror = None
+_mirror_modified = False
+_mirror_lock = threading.Lock()
 
 def update_zsh_completions():
   with open(ZSH_COMP_PATH, 'w') as f:
@@ -103,10 +202,20 @@ case "$state" in
       "--help:show help"
       "-g:get problem by id"
       "--get:get problem by id"
+      "--get-file:get every problem listed in a file"
       "-r:run test cases on sample inputs"
       "--run:run test cases on sample inputs"
+      "-j:number of test cases to run at once"
+      "--jobs:number of test cases to run at once"
+      "-c:compare outputs exactly, ignoring whitespace or as floats"
+      "--compare:compare outputs exactly, ignoring whitespace or as floats"
+      "--tolerance:error allowed by the float comparison"
+      "--json:print test case measurements as JSON"
+      "--no-cache:always recompile instead of reusing a cached build"
+      "--watch:rerun test cases whenever the source or samples change"
       "-p:submit solution to kattis"
       "--post:submit solution to kattis"
+      "--status:resume tracking a submission's result"
       "-v:set verbose"
       "--verbose:set verbose"
       "-d:display a problem's description in the default browser"
@@ -119,6 +228,14 @@ case "$state" in
       "--history:display submission history"
       "--history_size:set or query submission history size"
       "--update_period:set how frequently katti updates problem ratings in hours"
+      "--update_ratings:update every stale problem rating"
+      "--background:run --update_ratings in the background"
+      "--rate_limit:set the maximum requests per second when updating problem ratings"
+      "--background_refresh:set whether --stats and --random start a background rating update when one is due"
+      "--mirror_age:set how many hours mirrored problems are used before fetching them again"
+      "--mirror_export:write the problem mirror to a zip file"
+      "--mirror_import:add the problems in an exported mirror to the problem mirror"
+      "--limits:set the time and memory limits for running test cases"
       "--update_zsh_completions:update katti completions for zsh users"
     )
     _describe -t commands "command" commands && ret=0
@@ -144,22 +261,40 @@ return 1
 """)
 
 '''
-Adds a problem id to problems conf file
+Adds a problem id to the problem catalog
 '''
 def add(problem_id):
-  global problems_conf
-  rating = get_problem_rating(problem_id)
-  problems_conf[problem_id] = float(rating)
-  with open(PROBLEMS_CONF_PATH, 'w') as f:
-    f.write(json.dumps(problems_conf))
+  global modified
+  # a mirrored rating may be older than the one already in the catalog
+  rating, updated = get_problem_rating(problem_id, problem_id not in problems_conf)
+  if problem_id in problems_conf:
+    apply_ratings([(problem_id, float(rating), updated)])
+    return
+  problems_conf.add(problem_id, float(rating), updated)
+  # solves of a problem missing from the catalog weren't counted in the stats
+  if "stats" in user_conf:
+    for ext in get_solved_languages(problem_id):
+      if ext in user_conf["stats"]:
+        add_language_stats(user_conf["stats"][ext], problem_id, float(rating))
+        modified = True
 
 """
-Gets the a problem's rating and sample inputs from kattis
+Gets problems' ratings and sample inputs from kattis and sets up a directory for
+each. Problems in the local mirror are taken from it, the rest are downloaded
+at once over the shared session and mirrored. Problems already set up in the
+current directory are skipped, and the language is only asked for once
 
-Params: A string problem_id
+Params: A list of string problem_ids
 Returns: None
 """
-def get(problem_id):
+def get(problem_ids):
+  # the same id given twice is only fetched once
+  problem_ids = list(dict.fromkeys(problem_ids))
+  for problem_id in [k for k in problem_ids if os.path.exists(k)]:
+    print("Skipping %s, it is already set up" % problem_id)
+    problem_ids.remove(problem_id)
+  if not problem_ids:
+    return
   # get programming language and extension
   while True:
     language = input("Programming Language: ").lower()
@@ -167,74 +302,569 @@ def get(problem_id):
       extension = _suported_langs[language]
       break
     print("Language \"%s\" not suported..." % language)
-  # make GET call for problem rating
-  rating = get_problem_rating(problem_id)
-  # make GET call for samples zip file
+  if len(problem_ids) > 1:
+    print("Downloading %i problems..." % len(problem_ids))
+  workers = min(len(problem_ids), user_conf.get("refresh_workers", DEFAULT_REFRESH_WORKERS))
+  limiter = RateLimiter(user_conf.get("refresh_rate_limit", DEFAULT_REFRESH_RATE_LIMIT))
+  def fetch(problem_id):
+    # problems fetched before, here or on another machine, need no requests
+    entry = get_mirrored(problem_id)
+    if entry is not None:
+      samples = read_mirrored_samples(entry["samples"])
+      if samples is not None:
+        return (entry["rating"], samples)
+    try:
+      limiter.wait()
+      rating = fetch_problem_rating(problem_id)
+      limiter.wait()
+      samples = fetch_samples(problem_id)
+    except KattisError as e:
+      return e
+    except requests.exceptions.RequestException as e:
+      return KattisError("Connection Failed: %s" % e)
+    # the mirror only saves requests later, so failing to write it isn't fatal
+    with contextlib.suppress(OSError):
+      mirror_problem(problem_id, rating, samples)
+    return (rating, samples)
+  import concurrent.futures
+  with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as pool:
+    downloads = pool.map(fetch, problem_ids)
+    failed = 0
+    # set up each problem as soon as it arrives, in the order given
+    for problem_id, download in zip(problem_ids, downloads):
+      if isinstance(download, KattisError):
+        print("Unable to get %s: %s" % (problem_id, download))
+        failed += 1
+        continue
+      rating, samples = download
+      set_up_problem(problem_id, extension, rating, samples, len(problem_ids) == 1)
+  if failed == len(problem_ids):
+    print("Aborting...")
+    sys.exit(0)
+
+
+"""
+Helper function to download a problem's sample inputs from kattis
+
+Params: A string problem_id
+Returns: The bytes of the samples zip file
+Raises: A KattisError for a bad response, requests exceptions for connection failures
+"""
+def fetch_samples(problem_id):
+  url = "https://open.kattis.com/problems/" + problem_id + "/file/statement/samples.zip"
   if verbose:
-    print("Making http request: https://open.kattis.com/problems/" + problem_id + "/file/statement/samples.zip")
-  r = requests.get("https://open.kattis.com/problems/" + problem_id + "/file/statement/samples.zip")
+    print("Making http request: " + url)
+  r = get_session().get(url)
   # bad request
   if r.status_code != 200:
-    print("URL <{}> returned non 200 status".format(r.url))
+    raise KattisError("URL <{}> returned non 200 status".format(r.url), r.status_code)
+  return r.content
+
+
+"""
+Helper function to create a problem's directory from its downloaded samples and
+write the boilerplate file. The directory is put together under a private name
+and renamed into place once it's complete, so concurrent runs never see or
+clobber each other's half written problems
+
+Params: A string problem_id, a string extension, a string rating, the bytes of
+        the samples zip file, a bool whether to offer to open the description
+Returns: None
+"""
+def set_up_problem(problem_id, extension, rating, samples, describe):
+  if verbose:
+    print("Sample files found for %s!" % problem_id)
+  # other threads are setting up problems too, so neither the umask nor the
+  # working directory may be touched here
+  build_directory = ".%s.%i.%i.%08x" % (problem_id, os.getpid(), threading.get_ident(), random.getrandbits(32))
+  try:
+    os.mkdir(build_directory)
+    extract_samples(samples, build_directory)
+    if verbose:
+      print("Writing boilerplate files...")
+    write_boilerplate(problem_id, extension, rating, build_directory)
+    os.rename(build_directory, problem_id)
+  except OSError as e:
+    shutil.rmtree(build_directory, ignore_errors=True)
+    if os.path.exists(problem_id):
+      print("Skipping %s, it is already set up" % problem_id)
+    else:
+      print("Unable to set up %s: %s" % (problem_id, e))
+    return
+  if describe:
+    show_description(problem_id)
+
+
+"""
+Helper function to extract the sample inputs and answers from a samples zip file
+held in memory. Each file is decompressed straight to disk, and only file names
+are kept so nothing is written outside the directory
+
+Params: The bytes of the samples zip file, a string directory
+Returns: None
+Raises: An OSError if the archive is corrupt
+"""
+def extract_samples(samples, directory):
+  import zipfile
+  try:
+    archive = zipfile.ZipFile(io.BytesIO(samples))
+  except zipfile.BadZipFile as e:
+    raise OSError("bad samples zip file: %s" % e)
+  with archive:
+    for member in archive.infolist():
+      name = os.path.basename(member.filename)
+      if member.is_dir() or not name:
+        continue
+      if verbose:
+        print("  extracting: %s" % name)
+      with archive.open(member) as src, open(os.path.join(directory, name), mode="wb") as dst:
+        shutil.copyfileobj(src, dst)
+
+
+"""
+Reads problem ids from a file for --get-file, separated by whitespace or one per
+line. Anything after a # on a line is a comment
+
+Params: A string path
+Returns: A list of string problem_ids
+"""
+def read_problem_list(path):
+  try:
+    with open(path) as f:
+      return [k for line in f for k in line.split("#")[0].split()]
+  except OSError as e:
+    print("Unable to read problem list:", e)
+    print("Aborting...")
+    sys.exit(0)
+
+
+"""
+Helper function to get the current rating of problem from the mirror or Kattis,
+aborting on failure
+
+Params: A string problem_id, a bool use_mirror
+Returns: A tuple of a string representing the problem's rating and the int time
+         it was fetched, which is earlier than now when it came from the mirror
+"""
+def get_problem_rating(problem_id, use_mirror=True):
+  entry = get_mirrored(problem_id) if use_mirror else None
+  if entry is not None:
+    return (entry["rating"], int(entry["fetched"]))
+  try:
+    return (fetch_problem_rating(problem_id), int(time.time()))
+  except KattisError as e:
+    print(e)
+    print("Aborting...")
+    sys.exit(0)
+  except requests.exceptions.RequestException as e:
+    print("Connection Failed:", e)
     print("Aborting...")
     sys.exit(0)
-  # download and write zip file
-  if verbose:
-    print("Sample files found!")
-    print("Downloading zip file...")
-    print()
-  with open("samples.zip", mode="wb") as f:
-    f.write(r.content)
-    f.close()
-  # create the directory, unzip the samples, remove the zip file, create the boilerplate file
-  if verbose:
-    os.system("mkdir -v %s" % problem_id)
-    print()
-    os.system("unzip samples.zip -d %s" % problem_id)
-    print()
-    os.system("rm -iv samples.zip")
-    print()
-    print("Writing boilerplate files...")
-    os.chdir(problem_id)
-    write_boilerplate(problem_id, extension, rating)
-    show_description()
-    os.chdir("..")
-  else:
-    os.system("mkdir -p %s" % problem_id)
-    os.system("unzip -q samples.zip -d %s" % problem_id)
-    os.system("rm samples.zip")
-    os.chdir(problem_id)
-    write_boilerplate(problem_id, extension, rating)
-    show_description()
-    os.chdir("..")
 
 
 """
-Helper function to get the current rating of problem from Kattis
+Fetches the current rating of problem from Kattis. Pages fetched within the
+page cache's ttl are not requested again, and older ones are revalidated with
+a conditional request so unchanged pages come back empty
 
 Params: A string problem_id
 Returns: A string representing the problem's rating
+Raises: A KattisError for a bad response, requests exceptions for connection failures
 """
-def get_problem_rating(problem_id):
-  r = requests.get("https://open.kattis.com/problems/" + problem_id)
-  # bad request
-  if r.status_code != 200:
-    print("URL <{}> returned non 200 status".format(r.url))
+def fetch_problem_rating(problem_id):
+  url = "https://open.kattis.com/problems/" + problem_id
+  entry = get_cached_page(url)
+  headers = {}
+  if entry is not None:
+    ttl = user_conf.get("page_cache_ttl", DEFAULT_PAGE_CACHE_TTL) * 3600 if user_conf else 0
+    if time.time() - entry["fetched"] < ttl:
+      return entry["rating"]
+    if entry.get("etag"):
+      headers["If-None-Match"] = entry["etag"]
+    if entry.get("last_modified"):
+      headers["If-Modified-Since"] = entry["last_modified"]
+  with get_session().get(url, headers=headers, stream=True) as r:
+    # unchanged since it was cached
+    if r.status_code == 304 and entry is not None:
+      entry["fetched"] = time.time()
+      set_cached_page(url, entry)
+      return entry["rating"]
+    # bad request
+    if r.status_code != 200:
+      raise KattisError("URL <{}> returned non 200 status".format(r.url), r.status_code)
+    rating = find_rating(r)
+  if rating is None:
+    raise KattisError("Unable to find a difficulty rating on <{}>".format(url))
+  set_cached_page(url, {
+    "etag": r.headers.get("ETag"),
+    "last_modified": r.headers.get("Last-Modified"),
+    "rating": rating,
+    "fetched": time.time()
+  })
+  return rating
+
+
+"""
+Helper function for fetch_problem_rating(). Reads a streamed problem page a chunk
+at a time and stops as soon as the difficulty turns up, so the rest of the page
+is never downloaded
+
+Params: A streamed requests response
+Returns: A string representing the problem's rating, or None if the page has none
+"""
+def find_rating(response):
+  window = b""
+  for chunk in response.iter_content(chunk_size=_RATING_CHUNK_SIZE):
+    window += chunk
+    match = _rating_pattern.search(window)
+    if match is not None:
+      return match.group(1).decode()
+    # keep enough of the tail to match a difficulty split across chunks
+    window = window[-_RATING_OVERLAP:]
+  return None
+
+
+# where a problem page gives its difficulty
+_rating_pattern = re.compile(rb"Difficulty:[ </>a-z]*([0-9]\.[0-9])")
+# bytes of a problem page read at a time, and kept between reads
+_RATING_CHUNK_SIZE = 1 << 13
+_RATING_OVERLAP = 256
+
+
+"""
+Helper function to look up a problem page in the page cache
+
+Params: A string url
+Returns: A dict of the page's validators and rating, or None if it isn't cached
+"""
+def get_cached_page(url):
+  global _page_cache
+  with _page_cache_lock:
+    if _page_cache is None:
+      _page_cache = {}
+      if os.path.exists(PAGE_CACHE_PATH):
+        try:
+          with open(PAGE_CACHE_PATH) as f:
+            _page_cache = json.load(f)
+        except ValueError:
+          # a corrupted cache is simply rebuilt
+          pass
+    entry = _page_cache.get(url)
+    return dict(entry) if entry is not None else None
+
+
+"""
+Helper function to store a problem page in the page cache
+
+Params: A string url, a dict entry
+Returns: None
+"""
+def set_cached_page(url, entry):
+  global _page_cache_modified
+  with _page_cache_lock:
+    _page_cache[url] = entry
+    _page_cache_modified = True
+
+
+"""
+Writes the page cache to disk if it changed, dropping the least recently
+fetched pages once it holds more than the configured number
+
+Params: None
+Returns: None
+"""
+def save_page_cache():
+  global _page_cache_modified
+  if not _page_cache_modified:
+    return
+  with _page_cache_lock:
+    size = user_conf.get("page_cache_size", DEFAULT_PAGE_CACHE_SIZE)
+    if len(_page_cache) > size:
+      recent = sorted(_page_cache.items(), key=lambda x: x[1]["fetched"], reverse=True)[:size]
+      _page_cache.clear()
+      _page_cache.update(recent)
+    os.makedirs(CACHE_DIR, exist_ok=True)
+    # write beside the cache and swap it in so readers never see a partial file
+    temp_path = PAGE_CACHE_PATH + ".%i.tmp" % os.getpid()
+    with open(temp_path, mode="w") as f:
+      f.write(json.dumps(_page_cache))
+    os.replace(temp_path, PAGE_CACHE_PATH)
+    _page_cache_modified = False
+
+
+"""
+Helper function to load the index of the problem mirror, a local store of the
+problems fetched with -g. Each entry holds a problem's rating, the time it was
+fetched and the sha256 of its samples zip file, which is stored under its hash
+
+Params: None
+Returns: A dict of problem ids to entries
+"""
+def load_mirror():
+  global _mirror
+  if _mirror is None:
+    _mirror = read_mirror_index(MIRROR_INDEX_PATH)
+  return _mirror
+
+
+"""
+Helper function to read a mirror index, treating a missing or corrupted one as empty
+
+Params: A string path
+Returns: A dict of problem ids to entries
+"""
+def read_mirror_index(path):
+  try:
+    with open(path) as f:
+      return json.load(f)
+  except (OSError, ValueError):
+    return {}
+
+
+"""
+Helper function to get the path a sample archive is stored at in the mirror
+
+Params: A string sha256 digest
+Returns: A string path
+"""
+def mirror_object_path(digest):
+  return os.path.join(MIRROR_DIR, "objects", digest[:2], digest)
+
+
+"""
+Looks up a problem in the mirror, ignoring entries older than the mirror age
+
+Params: A string problem_id
+Returns: A dict entry, or None if the problem isn't mirrored or is stale
+"""
+def get_mirrored(problem_id):
+  with _mirror_lock:
+    entry = load_mirror().get(problem_id)
+  if entry is None:
+    return None
+  age = user_conf.get("mirror_age", DEFAULT_MIRROR_AGE) if user_conf else DEFAULT_MIRROR_AGE
+  if time.time() - entry["fetched"] >= age * 3600:
+    return None
+  return dict(entry)
+
+
+"""
+Reads a sample archive from the mirror, checking it against its hash
+
+Params: A string sha256 digest
+Returns: The bytes of the samples zip file, or None if it's missing or damaged
+"""
+def read_mirrored_samples(digest):
+  import hashlib
+  try:
+    with open(mirror_object_path(digest), mode="rb") as f:
+      samples = f.read()
+  except OSError:
+    return None
+  return samples if hashlib.sha256(samples).hexdigest() == digest else None
+
+
+"""
+Stores a sample archive in the mirror under its hash. Archives already stored
+are left alone, so identical samples are only kept once
+
+Params: The bytes of a samples zip file
+Returns: A string sha256 digest
+"""
+def store_mirrored_samples(samples):
+  import hashlib
+  digest = hashlib.sha256(samples).hexdigest()
+  path = mirror_object_path(digest)
+  if not os.path.exists(path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = path + ".%i.%i.tmp" % (os.getpid(), threading.get_ident())
+    with open(temp_path, mode="wb") as f:
+      f.write(samples)
+    os.replace(temp_path, path)
+  return digest
+
+
+"""
+Adds a freshly fetched problem to the mirror
+
+Params: A string problem_id, a string rating, the bytes of the samples zip file
+Returns: None
+"""
+def mirror_problem(problem_id, rating, samples):
+  global _mirror_modified
+  digest = store_mirrored_samples(samples)
+  with _mirror_lock:
+    load_mirror()[problem_id] = {"rating": rating, "samples": digest, "fetched": time.time()}
+    _mirror_modified = True
+
+
+"""
+Writes the mirror index to disk if it changed. Entries another katti process
+saved in the meantime are kept unless this process fetched the problem later
+
+Params: None
+Returns: None
+"""
+def save_mirror():
+  global _mirror_modified
+  if not _mirror_modified:
+    return
+  os.makedirs(MIRROR_DIR, exist_ok=True)
+  with _mirror_lock, lock_file(MIRROR_INDEX_PATH):
+    merge_mirror_index(_mirror, read_mirror_index(MIRROR_INDEX_PATH))
+    write_json(MIRROR_INDEX_PATH, _mirror)
+    _mirror_modified = False
+
+
+"""
+Helper function to merge one mirror index into another, keeping the most
+recently fetched entry for each problem
+
+Params: A dict index to merge into, a dict index
+Returns: The number of entries taken from the second index
+"""
+def merge_mirror_index(index, other):
+  taken = 0
+  for problem_id, entry in other.items():
+    if problem_id not in index or entry["fetched"] > index[problem_id]["fetched"]:
+      index[problem_id] = entry
+      taken += 1
+  return taken
+
+
+"""
+Writes every problem in the mirror to a zip file, to seed the mirror on
+another machine with --mirror_import
+
+Params: A string path
+Returns: None
+"""
+def export_mirror(path):
+  import zipfile
+  index = {}
+  written = set()
+  with zipfile.ZipFile(path, mode="w") as archive:
+    for problem_id, entry in load_mirror().items():
+      samples = read_mirrored_samples(entry["samples"])
+      if samples is None:
+        continue
+      name = "objects/" + entry["samples"]
+      # problems with identical samples share one copy
+      if name not in written:
+        archive.writestr(name, samples)
+        written.add(name)
+      index[problem_id] = entry
+    archive.writestr("index.json", json.dumps(index))
+  print("Exported %i problems to %s" % (len(index), path))
+
+
+"""
+Adds the problems in a zip file written by --mirror_export to the mirror,
+keeping whichever copy of a problem was fetched most recently. Sample archives
+that don't match their hash are skipped
+
+Params: A string path
+Returns: None
+"""
+def import_mirror(path):
+  global _mirror_modified
+  import hashlib
+  import zipfile
+  try:
+    with zipfile.ZipFile(path) as archive:
+      index = {}
+      for problem_id, entry in json.loads(archive.read("index.json")).items():
+        try:
+          samples = archive.read("objects/" + entry["samples"])
+        except KeyError:
+          continue
+        if hashlib.sha256(samples).hexdigest() != entry["samples"]:
+          continue
+        store_mirrored_samples(samples)
+        index[problem_id] = entry
+  except (OSError, KeyError, ValueError, zipfile.BadZipFile) as e:
+    print("Unable to import mirror:", e)
     print("Aborting...")
     sys.exit(0)
-  search = re.findall("Difficulty:[ </>a-z]*[0-9]\.[0-9]", r.text)[0]
-  rating = search.split('>')[-1]
-  return rating
+  with _mirror_lock:
+    taken = merge_mirror_index(load_mirror(), index)
+    _mirror_modified = True
+  print("Imported %i problems from %s" % (taken, path))
 
 
 """
-Opens a problem description in the default browser, either Chrome or Firefox
+Set how many hours mirrored problems are used before they're fetched again
+
+Params: A string age
+Returns: None
+"""
+def set_mirror_age(age):
+  global modified
+  invalid = False
+  try:
+    age = float(age)
+  except ValueError:
+    invalid = True
+  if invalid or age < 0:
+    print("Invalid mirror age. Must be a number of hours >= 0 (0 never uses the mirror)")
+    print("Aborting...")
+    sys.exit(0)
+  user_conf["mirror_age"] = age
+  modified = True
+
+
+"""
+Helper function to get the http session shared by all requests, so connections
+to kattis are kept alive and reused
 
 Params: None
+Returns: A requests Session object
+"""
+def get_session():
+  global _session
+  # download and refresh workers may all ask for the session at once
+  with _session_lock:
+    if _session is None:
+      import_requests()
+      session = requests.Session()
+      workers = user_conf.get("refresh_workers", DEFAULT_REFRESH_WORKERS) if user_conf else DEFAULT_REFRESH_WORKERS
+      adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+      session.mount("https://", adapter)
+      _session = session
+  return _session
+
+
+"""
+Spaces out calls made from any number of threads so that no more than a given
+number happen per second
+"""
+class RateLimiter:
+  def __init__(self, rate):
+    self.interval = 1 / rate if rate > 0 else 0
+    self.next_call = time.monotonic()
+    self.lock = threading.Lock()
+
+  # blocks until the caller may proceed
+  def wait(self):
+    if not self.interval:
+      return
+    with self.lock:
+      now = time.monotonic()
+      delay = self.next_call - now
+      self.next_call = max(now, self.next_call) + self.interval
+    if delay > 0:
+      time.sleep(delay)
+
+
+"""
+Opens a problem description in the default browser, either Chrome or Firefox
+
+Params: A string problem_id, the current directory's problem when not given
 Returns: None
 """
-def show_description():
-  problem_id = os.path.basename(os.getcwd())
+def show_description(problem_id=None):
+  if problem_id is None:
+    problem_id = os.path.basename(os.getcwd())
   if problem_id not in problems_conf:
     print("Invalid problem ID: %s" % problem_id)
     print("Aborting...")
@@ -283,10 +913,11 @@ def set_default_browser():
 """
 Opens and writes basic boilerplate to a file based on file type
 
-Params: A string problem_id, a string extension, a string rating
+Params: A string problem_id, a string extension, a string rating, a string
+        directory to write the file in
 Returns: None
 """
-def write_boilerplate(problem_id, extension, rating):
+def write_boilerplate(problem_id, extension, rating, directory="."):
   # c++ boilerplate
   if extension == ".cpp":
     content =\
@@ -313,7 +944,7 @@ int main() {
 }
 """ % (rating, problem_id)
 
-    with open(problem_id + extension, mode="w") as f:
+    with open(os.path.join(directory, problem_id + extension), mode="w") as f:
       f.write(content)
       f.close()
 
@@ -337,7 +968,7 @@ public class %s {
 }
 """ % (rating, problem_id, problem_id)
 
-    with open(problem_id + extension, mode="w") as f:
+    with open(os.path.join(directory, problem_id + extension), mode="w") as f:
       f.write(content)
       f.close()
 
@@ -354,30 +985,203 @@ if __name__ == "__main__":
   main()
 """ % (rating, problem_id)
 
-    with open(problem_id + extension, mode="w") as f:
+    with open(os.path.join(directory, problem_id + extension), mode="w") as f:
       f.write(content)
       f.close()
 
 
 """
 Runs all the sample inputs for a given kattis problem and checks them for
-basic correctness (does not check relative error)
+correctness, either exactly, ignoring whitespace or within a float tolerance
 
-Params: None
+Params: An int jobs, the number of test cases to run at once, a bool as_json,
+        a string comparison mode, a float tolerance for the float mode,
+        a bool use_cache to reuse previous builds of unchanged sources,
+        a bool watch to keep rerunning whenever the source or samples change
 Returns: None
 """
-def run():
+def run(jobs=None, as_json=False, mode="exact", tolerance=DEFAULT_TOLERANCE, use_cache=True, watch=False):
   file_name = os.path.basename(os.getcwd())
   # find which language to use
   extension = get_source_extension(file_name)
   samples, answers = get_samples_and_answers()
-  executable = run_compiler(file_name, extension)
-  if executable is not None:
-    if samples and answers:
-      run_test_cases(executable, samples, answers)
-    else:
-      print("No sample inputs and answers found")
-      print("Aborting...")
+  time_limit, memory_limit = get_limits(file_name)
+  # uncached builds live only as long as the run
+  with tempfile.TemporaryDirectory(prefix="katti-") as build_directory:
+    if watch:
+      if extension is not None:
+        watch_run(file_name, extension, build_directory, jobs, as_json, time_limit, memory_limit,
+                  mode, tolerance, use_cache)
+      return
+    executable = run_compiler(file_name, extension, use_cache, build_directory)
+    if executable is not None:
+      if samples and answers:
+        run_test_cases(executable, samples, answers, jobs, as_json, time_limit, memory_limit, mode, tolerance)
+      else:
+        print("No sample inputs and answers found")
+        print("Aborting...")
+
+
+"""
+Rebuilds and reruns a problem's test cases every time its source or sample
+files are saved, until interrupted. A change is only acted on once the files
+have been quiet for a moment, the source is only rebuilt when it changed, and
+the cases whose files changed or that failed last time are run first. Each run
+reports the time from the save to the verdict
+
+Params: A string file_name, a string extension, a string build_directory for
+        uncached builds, an int jobs, a bool as_json, a float time_limit in
+        seconds, an int memory_limit in megabytes, a string comparison mode, a
+        float tolerance for the float mode, a bool use_cache
+Returns: None
+"""
+def watch_run(file_name, extension, build_directory, jobs, as_json, time_limit, memory_limit,
+              mode, tolerance, use_cache):
+  source = file_name + extension
+  watcher = get_watcher(
+    ".", lambda name: name == source or os.path.splitext(name)[1] in {".in", ".ans"}
+  )
+  executable = None
+  failed = set()
+  latencies = []
+  # the first pass builds and runs everything
+  changed, saved = {source}, None
+  try:
+    while True:
+      if source in changed:
+        executable = run_compiler(file_name, extension, use_cache, build_directory) \
+          if os.path.exists(source) else None
+      samples, answers = get_samples_and_answers()
+      if executable is None:
+        print("Unable to build %s, waiting for it to change..." % source)
+      elif not samples or not answers:
+        print("No sample inputs and answers found, waiting for them...")
+      else:
+        first = failed | {os.path.splitext(name)[0] + ".in" for name in changed if name != source}
+        results = run_test_cases(executable, samples, answers, jobs, as_json, time_limit, memory_limit,
+                                 mode, tolerance, first)
+        failed = {result["case"] for result in results if not result["passed"]}
+        if saved is not None and not as_json:
+          latencies.append(time.time() - saved)
+          print("Save to verdict: %.2fs (average %.2fs over %i runs)" % (
+            latencies[-1], sum(latencies) / len(latencies), len(latencies)
+          ))
+      if not as_json:
+        print("Watching for changes, press Ctrl-C to stop...")
+      changed, saved = watcher.wait()
+      if not as_json:
+        print()
+        print("[%s] Changed: %s" % (datetime.now().strftime("%H:%M:%S"), ", ".join(sorted(changed))))
+  except KeyboardInterrupt:
+    print()
+  finally:
+    watcher.close()
+
+
+"""
+Helper function for watch_run(). Watches a directory with inotify where it's
+available and falls back to polling the files' modification times
+
+Params: A string directory, a function taking a file name and returning whether to watch it
+Returns: An InotifyWatcher or a PollingWatcher
+"""
+def get_watcher(directory, watched):
+  try:
+    return InotifyWatcher(directory, watched)
+  except (OSError, AttributeError):
+    if verbose:
+      print("inotify isn't available, polling for changes instead...")
+    return PollingWatcher(directory, watched)
+
+
+"""
+Waits for watched files in a directory to change using linux's inotify, through
+libc so nothing needs installing
+"""
+class InotifyWatcher:
+  def __init__(self, directory, watched):
+    import ctypes
+    import ctypes.util
+    libc = ctypes.CDLL(ctypes.util.find_library("c") or "libc.so.6", use_errno=True)
+    self.watched = watched
+    self.fd = libc.inotify_init1(os.O_CLOEXEC)
+    if self.fd < 0:
+      raise OSError(ctypes.get_errno(), "inotify_init1 failed")
+    mask = _IN_CLOSE_WRITE | _IN_MOVED_FROM | _IN_MOVED_TO | _IN_DELETE
+    if libc.inotify_add_watch(self.fd, os.fsencode(directory), mask) < 0:
+      os.close(self.fd)
+      raise OSError(ctypes.get_errno(), "inotify_add_watch failed")
+
+  # blocks until watched files change and then go quiet, returning their names
+  # and the time of the first change
+  def wait(self):
+    import select
+    changed = set()
+    saved = None
+    while True:
+      ready, _, _ = select.select([self.fd], [], [], WATCH_DEBOUNCE if changed else None)
+      if not ready:
+        return (changed, saved)
+      names = {name for name in self.read_names() if self.watched(name)}
+      if names and not changed:
+        saved = time.time()
+      changed |= names
+
+  # the names of the files in the pending events
+  def read_names(self):
+    import struct
+    data = os.read(self.fd, 1 << 16)
+    offset = 0
+    while offset < len(data):
+      _, _, _, length = struct.unpack_from("iIII", data, offset)
+      offset += 16
+      yield data[offset:offset + length].rstrip(b"\0").decode(errors="replace")
+      offset += length
+
+  # stops watching
+  def close(self):
+    os.close(self.fd)
+
+
+"""
+Waits for watched files in a directory to change by checking their modification
+times and sizes every so often, for systems without inotify
+"""
+class PollingWatcher:
+  def __init__(self, directory, watched):
+    self.directory = directory
+    self.watched = watched
+    self.snapshot = self.scan()
+
+  # the modification time and size of every watched file
+  def scan(self):
+    files = {}
+    for entry in os.scandir(self.directory):
+      if self.watched(entry.name) and entry.is_file():
+        stat = entry.stat()
+        files[entry.name] = (stat.st_mtime, stat.st_size)
+    return files
+
+  # blocks until watched files change and then go quiet, returning their names
+  # and the time of the first change
+  def wait(self):
+    changed = set()
+    saved = None
+    while True:
+      time.sleep(WATCH_POLL_INTERVAL)
+      current = self.scan()
+      names = {name for name in current.keys() | self.snapshot.keys() if current.get(name) != self.snapshot.get(name)}
+      self.snapshot = current
+      if not names and changed:
+        return (changed, saved)
+      if names and not changed:
+        # removed files have no modification time to go by
+        saved = min((current[name][0] for name in names if name in current), default=time.time())
+      changed |= names
+
+  # nothing to clean up
+  def close(self):
+    pass
 
 
 """
@@ -418,35 +1222,37 @@ def get_samples_and_answers():
 Helper function for run() method. Compiles the code for compiled languages and checks
 existence of interpreter for interpreted languages
 
-Params: A string file_name, a string extension
-Returns: A string representing a system call to run the source code, or None on failure
+Params: A string file_name, a string extension, a bool use_cache,
+        a string build_directory to compile into when not using the cache
+Returns: A list of arguments to run the source code, or None on failure
 """
-def run_compiler(file_name, extension):
-  status = 1
+def run_compiler(file_name, extension, use_cache=True, build_directory=None):
   if extension == ".cpp":
     # check presence of g++ compiler
-    status = os.system("which -s g++")
-    if status != 0:
+    if shutil.which("g++") is None:
       print("Unable to locate g++ compiler")
       print("Aborting...")
       return None
     # compile the code
-    if verbose:
-      print("Compiling %s..." % (file_name + extension))
-    os.system("g++ -std=c++11 %s" % (file_name + extension))
-    return "./a.out"
+    output_flags = lambda directory: ["-o", os.path.join(directory, "a.out")]
+    if use_cache:
+      build = get_cached_build(file_name + extension, "g++", ["-std=c++11"], output_flags)
+    else:
+      build = compile_source(file_name + extension, "g++", ["-std=c++11"], output_flags, build_directory)
+    return None if build is None else [os.path.join(build, "a.out")]
   if extension == ".java":
     # check existence of javac compiler
-    status = os.system("which -s javac")
-    if status != 0:
+    if shutil.which("javac") is None:
       print("Unable to locate javac compiler")
       print("Aborting...")
       return None
     # compile the code
-    if verbose:
-      print("Compiling %s..." % (file_name + extension))
-    os.system("javac %s" % (file_name + extension))
-    return "java " + file_name
+    output_flags = lambda directory: ["-d", directory]
+    if use_cache:
+      build = get_cached_build(file_name + extension, "javac", [], output_flags)
+    else:
+      build = compile_source(file_name + extension, "javac", [], output_flags, build_directory)
+    return None if build is None else ["java", "-cp", build, file_name]
   if extension == ".py":
     if verbose:
       print("Trying to infer Python version...")
@@ -457,73 +1263,587 @@ def run_compiler(file_name, extension):
       + "\nAborting..."
     )
     if version == 2:
-      status = os.system("which -s python2")
-      if status != 0:
+      if shutil.which("python2") is None:
         print("Unable to locate Python 2 interpreter")
         print(python_warning)
         return None
-      return "python2 " + file_name + extension
+      return ["python2", file_name + extension]
     else:
-      status = os.system("which -s python3")
-      if status != 0:
+      if shutil.which("python3") is None:
         print("Unable to locate Python 3 interpreter")
         print(python_warning)
         return None
-      return "python3 " + file_name + extension
+      return ["python3", file_name + extension]
 
 
 """
-Runs a given kattis problem through the provided sample inputs - assumes
-code is already compiled
+Helper function for run_compiler(). Looks up a build of the source in the build
+cache, which is keyed on the source's contents, the compiler's version and the
+flags, and compiles it into the cache on a miss
 
-Params: A command line string executable, a list of sample input files,
-        a list of expected output files
-Returns: None
+Params: A string source file, a string compiler, a list of string flags,
+        a function mapping an output directory to the compiler's output flags
+Returns: A string path to the build's directory, or None if compilation failed
 """
-def run_test_cases(executable, sample_files, expected):
-  print("Running test cases...")
-  for i, sample in enumerate(sample_files):
-    fail = False
-    # get rid of .in extension in order to match with corresponding .ans file
-    base = '.'.join(sample.split('.')[:-1])
-    executable += " < " +  sample + " > test.out"
-    os.system(executable)
-    status = os.system("cmp test.out %s.ans" % base)
-    if status != 0:
-      if verbose:
-        print("FAIL on sample input %s" % sample)
-        print("<<< Expected Output >>>")
-        with open(base + ".ans", mode="r") as f:
-          print(f.read())
-          f.close()
-        print("<<< Actual Output >>>")
-        with open("test.out", mode="r") as f:
-          print(f.read())
-          f.close()
-      else:
-        print("-", end="")
-    else:
-      if verbose:
-        print("PASS on sample input: %s" % sample)
-      else:
-        print("+", end="")
-  os.system("rm *.out 2>/dev/null")
-  os.system("rm *.class 2>/dev/null")
-  # formatting
-  print()
+def get_cached_build(source, compiler, flags, output_flags):
+  key = get_build_key(source, compiler, flags)
+  entry = os.path.join(BUILD_CACHE_DIR, key)
+  if os.path.isdir(entry):
+    if verbose:
+      print("Using cached build of %s..." % source)
+    # mark the entry as recently used
+    os.utime(entry)
+    return entry
+  os.makedirs(BUILD_CACHE_DIR, exist_ok=True)
+  # compile somewhere private so a failed or concurrent build never leaves a partial entry
+  directory = tempfile.mkdtemp(dir=BUILD_CACHE_DIR, prefix=".build-")
+  if compile_source(source, compiler, flags, output_flags, directory) is None:
+    shutil.rmtree(directory, ignore_errors=True)
+    return None
+  try:
+    os.rename(directory, entry)
+  except OSError:
+    # another katti process cached the same build first
+    shutil.rmtree(directory, ignore_errors=True)
+  evict_cached_builds(key)
+  return entry
 
 
 """
-Scans a python file for tokens exclusive to python 2 to infer the python version
+Helper function for run_compiler(). Compiles a source file into a directory
 
-Params: A file name to scan
-Returns: An integer version of python
+Params: A string source file, a string compiler, a list of string flags,
+        a function mapping an output directory to the compiler's output flags,
+        a string directory
+Returns: The string directory, or None if compilation failed
 """
-def determine_python_version(file_name):
-  with open(file_name, mode="r") as f:
-    for line in f:
-      if "xrange" in line:
-        if verbose:
+def compile_source(source, compiler, flags, output_flags, directory):
+  if verbose:
+    print("Compiling %s..." % source)
+  if subprocess.run([compiler] + flags + output_flags(directory) + [source]).returncode != 0:
+    print("Compilation failed")
+    print("Aborting...")
+    return None
+  return directory
+
+
+"""
+Helper function for get_cached_build(). Hashes everything that affects a build
+
+Params: A string source file, a string compiler, a list of string flags
+Returns: A string hex digest
+"""
+def get_build_key(source, compiler, flags):
+  if compiler not in _compiler_versions:
+    _compiler_versions[compiler] = subprocess.run(
+      [compiler, "-version" if compiler == "javac" else "--version"],
+      stdout=subprocess.PIPE,
+      stderr=subprocess.STDOUT
+    ).stdout
+  version = _compiler_versions[compiler]
+  import hashlib
+  digest = hashlib.sha256()
+  with open(source, mode="rb") as f:
+    digest.update(f.read())
+  digest.update(b"\0" + version + b"\0" + " ".join(flags).encode())
+  digest.update(b"\0" + os.path.basename(source).encode())
+  return digest.hexdigest()
+
+
+# compiler versions already asked for, so --watch rebuilds don't ask again
+_compiler_versions = {}
+
+
+"""
+Helper function for get_cached_build(). Removes the least recently used builds
+until the cache fits within the configured size
+
+Params: A string key of a build that must be kept
+Returns: None
+"""
+def evict_cached_builds(keep):
+  limit = user_conf.get("build_cache_size", DEFAULT_BUILD_CACHE_SIZE) * 1024 * 1024
+  entries = []
+  total = 0
+  for key in os.listdir(BUILD_CACHE_DIR):
+    path = os.path.join(BUILD_CACHE_DIR, key)
+    if key.startswith(".") or not os.path.isdir(path):
+      continue
+    size = sum(
+      os.path.getsize(os.path.join(root, f))
+      for root, _, files in os.walk(path)
+      for f in files
+    )
+    entries.append((os.path.getmtime(path), key, size))
+    total += size
+  for _, key, size in sorted(entries):
+    if total <= limit:
+      break
+    if key == keep:
+      continue
+    if verbose:
+      print("Evicting cached build %s..." % key)
+    shutil.rmtree(os.path.join(BUILD_CACHE_DIR, key), ignore_errors=True)
+    total -= size
+
+
+"""
+Runs a given kattis problem through the provided sample inputs - assumes
+code is already compiled. Cases are run on a pool of workers but always
+reported in sorted order, followed by where each failing case first went wrong
+and a summary of each case's resource usage
+
+Params: A list of arguments executable, a list of sample input files,
+        a list of expected output files, an int jobs (defaults to cpu count),
+        a bool as_json to print the measurements as JSON instead,
+        a float time_limit in seconds, an int memory_limit in megabytes,
+        a string comparison mode, a float tolerance for the float mode,
+        a collection of sample input files to run and report before the rest
+Returns: A list of dicts describing each case's result
+"""
+def run_test_cases(executable, sample_files, expected, jobs=None, as_json=False,
+                   time_limit=DEFAULT_TIME_LIMIT, memory_limit=DEFAULT_MEMORY_LIMIT,
+                   mode="exact", tolerance=DEFAULT_TOLERANCE, first=()):
+  if jobs is None:
+    jobs = os.cpu_count() or 1
+  if jobs < 1:
+    print("Number of jobs must be a positive integer")
+    print("Aborting...")
+    sys.exit(0)
+  sample_files = sorted(sample_files, key=lambda sample: (sample not in first, sample))
+  results = []
+  if not as_json:
+    print("Running test cases...")
+  import concurrent.futures
+  with concurrent.futures.ThreadPoolExecutor(max_workers=jobs) as pool:
+    cases = pool.map(
+      lambda sample: run_test_case(executable, sample, time_limit, memory_limit, mode, tolerance),
+      sample_files
+    )
+    for result in cases:
+      results.append(result)
+      if as_json:
+        continue
+      if not result["passed"]:
+        if verbose:
+          print("%s on sample input %s" % (result["verdict"], result["case"]))
+          if result["mismatch"]:
+            print("First mismatch on line %i, token %i: expected \"%s\" but got \"%s\"" % (
+              result["mismatch"]["line"],
+              result["mismatch"]["token"],
+              result["mismatch"]["expected"],
+              result["mismatch"]["actual"]
+            ))
+          print("<<< Expected Output >>>")
+          print(result["expected"].decode("utf-8", "replace"))
+          print("<<< Actual Output >>>")
+          print(result["output"].decode("utf-8", "replace"))
+          if result["error"]:
+            print("<<< Standard Error >>>")
+            print(result["error"].decode("utf-8", "replace"))
+        else:
+          print(_verdict_symbols[result["verdict"]], end="", flush=True)
+      else:
+        if verbose:
+          print("PASS on sample input: %s" % result["case"])
+        else:
+          print("+", end="", flush=True)
+  # buffers are only needed for reporting failures
+  for result in results:
+    del result["expected"]
+    del result["output"]
+    del result["error"]
+  if as_json:
+    print(json.dumps(results, indent=2))
+    return results
+  # formatting
+  print()
+  if not verbose:
+    # the progress symbols don't say where a failing case went wrong
+    for result in results:
+      if result["mismatch"]:
+        print("%s: line %i, token %i" % (result["case"], result["mismatch"]["line"], result["mismatch"]["token"]))
+  print_case_summary(results)
+  return results
+
+
+# progress symbols for each verdict a test case can receive
+_verdict_symbols = {
+  "AC": "+",
+  "WA": "-",
+  "TLE": "T",
+  "MLE": "M",
+  "RTE": "R"
+}
+
+
+"""
+Helper function for run_test_cases(). Runs a single sample input, spooling
+its output to a buffer of its own so cases can safely run concurrently, and
+measures the wall time, cpu time and peak memory of the child process. The
+child is limited with setrlimit and killed if it exceeds its wall time
+
+Params: A list of arguments executable, a string sample input file,
+        a float time_limit in seconds, an int memory_limit in megabytes,
+        a string comparison mode, a float tolerance for the float mode
+Returns: A dict describing the case's result
+"""
+def run_test_case(executable, sample, time_limit=DEFAULT_TIME_LIMIT, memory_limit=DEFAULT_MEMORY_LIMIT,
+                  mode="exact", tolerance=DEFAULT_TOLERANCE):
+  # get rid of .in extension in order to match with corresponding .ans file
+  answer = os.path.splitext(sample)[0] + ".ans"
+  # the jvm reserves far more address space than it uses, so leave it unlimited
+  limit_memory = executable[0] != "java"
+  with open(sample, mode="rb") as f, \
+       tempfile.TemporaryFile() as error_file, \
+       tempfile.SpooledTemporaryFile(max_size=_COMPARE_CHUNK_SIZE) as output_file:
+    start = time.perf_counter()
+    report_read, report_write = os.pipe()
+    process = subprocess.Popen(
+      [sys.executable, "-S", "-I", "-c", _CASE_LAUNCHER, str(report_write), str(time_limit),
+       str(memory_limit if limit_memory else 0), str(time_limit * WALL_TIME_FACTOR)] + executable,
+      stdin=f,
+      stdout=subprocess.PIPE,
+      stderr=error_file,
+      pass_fds=(report_write,),
+      start_new_session=True
+    )
+    os.close(report_write)
+    # the launcher kills the solution at its wall time, this also gets whatever
+    # it left running and the launcher itself should it ever hang
+    killed = threading.Event()
+    def kill():
+      killed.set()
+      try:
+        os.killpg(process.pid, signal.SIGKILL)
+      except ProcessLookupError:
+        pass
+    timer = threading.Timer(time_limit * WALL_TIME_FACTOR + _LAUNCHER_GRACE, kill)
+    timer.start()
+    shutil.copyfileobj(process.stdout, output_file, _COMPARE_CHUNK_SIZE)
+    process.stdout.close()
+    _, status, usage = os.wait4(process.pid, 0)
+    timer.cancel()
+    wall = time.perf_counter() - start
+    # without a report from the launcher the solution's usage isn't known
+    user, system, memory = None, None, None
+    with os.fdopen(report_read, mode="rb") as report:
+      measured = report.read().split()
+    if measured:
+      status, user, system, memory, wall = int(measured[0]), float(measured[1]), \
+        float(measured[2]), int(measured[3]), float(measured[4])
+      if int(measured[5]):
+        killed.set()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    error_file.seek(0)
+    error = error_file.read()
+    output_file.seek(0)
+    if os.path.exists(answer):
+      with open(answer, mode="rb") as expected_file:
+        mismatch = compare_output(expected_file, output_file, mode, tolerance)
+        expected_file.seek(0)
+        expected_output = expected_file.read(_PREVIEW_SIZE)
+    else:
+      with io.BytesIO() as expected_file:
+        mismatch = compare_output(expected_file, output_file, mode, tolerance)
+      expected_output = b""
+    output_file.seek(0)
+    output = output_file.read(_PREVIEW_SIZE)
+  # ru_maxrss is in bytes on mac and kilobytes on linux
+  if memory is not None and sys.platform == "darwin":
+    memory //= 1024
+  cpu = user + system if user is not None else 0
+  # mirror the order in which the judge reports verdicts
+  if killed.is_set() or cpu > time_limit or process.returncode in {-signal.SIGXCPU, -signal.SIGKILL}:
+    verdict = "TLE"
+  elif (memory or 0) > memory_limit * 1024 or (process.returncode != 0 and any(m in error for m in _out_of_memory_markers)):
+    verdict = "MLE"
+  elif process.returncode != 0:
+    verdict = "RTE"
+  elif mismatch is not None:
+    verdict = "WA"
+  else:
+    verdict = "AC"
+  return {
+    "case": sample,
+    "passed": verdict == "AC",
+    "verdict": verdict,
+    "exit_code": process.returncode,
+    "wall": round(wall, 4),
+    "user": None if user is None else round(user, 4),
+    "sys": None if system is None else round(system, 4),
+    "memory_kb": memory,
+    "mismatch": mismatch,
+    "expected": expected_output,
+    "output": output,
+    "error": error
+  }
+
+
+"""
+Compares a program's output to the expected output one token at a time, reading
+both streams in fixed size chunks so large outputs compare in bounded memory.
+The exact mode also compares the whitespace between tokens, the whitespace mode
+ignores it and the float mode additionally accepts numbers within an absolute
+or relative tolerance
+
+Params: A binary file expected, a binary file actual, a string mode, a float tolerance
+Returns: None if the outputs match, otherwise a dict describing the first mismatch
+"""
+def compare_output(expected, actual, mode="exact", tolerance=DEFAULT_TOLERANCE):
+  keep_whitespace = mode == "exact"
+  expected_tokens = read_tokens(expected, keep_whitespace)
+  actual_tokens = read_tokens(actual, keep_whitespace)
+  while True:
+    line, index, expected_token = next(expected_tokens, (None, None, None))
+    _, _, actual_token = next(actual_tokens, (None, None, None))
+    if expected_token is None and actual_token is None:
+      return None
+    if expected_token == actual_token:
+      continue
+    if mode == "float" and isinstance(expected_token, bytes) and isinstance(actual_token, bytes) \
+       and floats_match(expected_token, actual_token, tolerance):
+      continue
+    if line is None:
+      # the program printed more than was expected
+      line, index = last_position(expected, keep_whitespace)
+    return {
+      "line": line,
+      "token": index,
+      "expected": preview_token(expected_token),
+      "actual": preview_token(actual_token)
+    }
+
+
+"""
+Helper function for compare_output(). Shows at most the preview size of a token
+
+Params: A token from read_tokens(), or None at the end of the output
+Returns: A string
+"""
+def preview_token(token):
+  if token is None:
+    return "<EOF>"
+  prefix, length = (token[0], token[1]) if isinstance(token, tuple) else (token, len(token))
+  text = prefix[:_PREVIEW_SIZE].decode("utf-8", "replace")
+  return text + "..." if length > _PREVIEW_SIZE else text
+
+
+"""
+Helper function for compare_output(). Lazily splits a binary stream into tokens.
+Tokens longer than a chunk are hashed as they're read instead of being kept
+whole, and are given as a tuple of their first bytes, their length and their
+hash, so two of them are still equal exactly when their bytes are
+
+Params: A binary file stream, a bool keep_whitespace to also yield the whitespace between tokens
+Returns: A generator of tuples of a line number, a token number on that line and the token
+"""
+def read_tokens(stream, keep_whitespace):
+  import hashlib
+  line, index = 1, 0
+  # the last token read, which may continue into the next chunk
+  token = None
+  space = False
+  digest = None
+  length = 0
+  while True:
+    chunk = stream.read(_COMPARE_CHUNK_SIZE)
+    for match in _token_pattern.finditer(chunk):
+      piece = match.group()
+      if match.start() == 0 and token is not None and piece[:1].isspace() == space:
+        length += len(piece)
+        if digest is None and length <= _COMPARE_CHUNK_SIZE:
+          token += piece
+        else:
+          if digest is None:
+            digest = hashlib.sha256(token)
+          digest.update(piece)
+          token = token[:_PREVIEW_SIZE]
+        if space and b"\n" in piece:
+          line, index = line + piece.count(b"\n"), 0
+        continue
+      if token is not None:
+        yield from finish_token(line_start, index_start, token, space, digest, length, keep_whitespace)
+      token, space, digest, length = piece, piece[:1].isspace(), None, len(piece)
+      # where the token starts, before any newlines in it are counted
+      line_start, index_start = line, index + (not space)
+      if not space:
+        index += 1
+      elif b"\n" in piece:
+        line, index = line + piece.count(b"\n"), 0
+    if not chunk:
+      if token is not None:
+        yield from finish_token(line_start, index_start, token, space, digest, length, keep_whitespace)
+      return
+
+
+"""
+Helper function for read_tokens(). Gives a finished token unless it's whitespace
+that isn't kept
+
+Params: An int line, an int token number, the bytes of the token or of its start,
+        a bool space, a hash of the whole token or None if it's short, an int
+        length, a bool keep_whitespace
+Returns: A generator of at most one (line, index, token) tuple
+"""
+def finish_token(line, index, token, space, digest, length, keep_whitespace):
+  if space and not keep_whitespace:
+    return
+  yield (line, index, token if digest is None else (token, length, digest.hexdigest()))
+
+
+# runs of whitespace and runs of everything else
+_token_pattern = re.compile(rb"\s+|\S+")
+
+
+"""
+Helper function for compare_output(). Finds the position just past the last token of a stream
+
+Params: A binary file stream, a bool keep_whitespace
+Returns: A tuple of a line number and a token number
+"""
+def last_position(stream, keep_whitespace):
+  stream.seek(0)
+  line, index = 1, 0
+  for line, index, _ in read_tokens(stream, keep_whitespace):
+    pass
+  return (line, index + 1)
+
+
+"""
+Helper function for compare_output(). Checks if two tokens are numbers within
+an absolute or relative tolerance of each other
+
+Params: A bytes expected token, a bytes actual token, a float tolerance
+Returns: A bool
+"""
+def floats_match(expected, actual, tolerance):
+  try:
+    expected, actual = float(expected), float(actual)
+  except ValueError:
+    return False
+  return abs(expected - actual) <= tolerance or abs(expected - actual) <= tolerance * abs(expected)
+
+
+# starts a test case with a cpu time limit, which sends SIGXCPU once exceeded,
+# and an address space limit unless it's 0. Cases run on threads, and setting
+# the limits between fork and exec of a threaded process can deadlock, so this
+# fresh single threaded interpreter forks the solution, sets its limits and
+# waits for it, killing it once it runs past its wall time. A process's peak
+# memory includes whatever it forked from, so measuring from here keeps katti's
+# own memory out of the solution's, leaving only the launcher's few megabytes as
+# a floor. The exit status, user and system time, peak memory, wall time and
+# whether the solution was killed are written to the report fd
+_CASE_LAUNCHER = """
+import os, resource, signal, sys, time
+report = int(sys.argv[1])
+seconds = int(float(sys.argv[2])) + 1
+size = int(sys.argv[3]) * 1024 * 1024
+start = time.perf_counter()
+pid = os.fork()
+if pid == 0:
+  try:
+    resource.setrlimit(resource.RLIMIT_CPU, (seconds, seconds + 1))
+    if size:
+      resource.setrlimit(resource.RLIMIT_AS, (size, size))
+    os.execvp(sys.argv[5], sys.argv[5:])
+  except OSError as e:
+    sys.stderr.write("%s: %s\\n" % (sys.argv[5], e))
+  os._exit(127)
+killed = []
+def kill(signum, frame):
+  killed.append(True)
+  os.kill(pid, signal.SIGKILL)
+signal.signal(signal.SIGALRM, kill)
+signal.setitimer(signal.ITIMER_REAL, float(sys.argv[4]))
+_, status, usage = os.wait4(pid, 0)
+signal.setitimer(signal.ITIMER_REAL, 0)
+wall = time.perf_counter() - start
+os.write(report, ("%i %r %r %i %r %i" % (
+  status, usage.ru_utime, usage.ru_stime, usage.ru_maxrss, wall, len(killed)
+)).encode())
+"""
+
+
+"""
+Gets the time and memory limits for local runs of a problem from the user config
+
+Params: A string problem_id
+Returns: A tuple of a float time limit in seconds and an int memory limit in megabytes
+"""
+def get_limits(problem_id):
+  limits = user_conf.get("limits", {}).get(problem_id, {})
+  return (limits.get("time", DEFAULT_TIME_LIMIT), limits.get("memory", DEFAULT_MEMORY_LIMIT))
+
+
+"""
+Sets the time and memory limits for local runs of the problem in the current directory
+
+Params: A string time_limit in seconds, a string memory_limit in megabytes
+Returns: None
+"""
+def set_limits(time_limit, memory_limit):
+  global modified
+  problem_id = os.path.basename(os.getcwd())
+  try:
+    time_limit = float(time_limit)
+    memory_limit = int(memory_limit)
+    if time_limit <= 0 or memory_limit <= 0:
+      raise ValueError
+  except ValueError:
+    print("Limits must be a positive number of seconds and a positive integer number of megabytes")
+    print("Aborting...")
+    sys.exit(0)
+  if "limits" not in user_conf:
+    user_conf["limits"] = {}
+  user_conf["limits"][problem_id] = {
+    "time": time_limit,
+    "memory": memory_limit
+  }
+  modified = True
+
+
+"""
+Prints a table of the resource usage for each test case, highlighting the
+slowest one
+
+Params: A list of result dicts from run_test_case()
+Returns: None
+"""
+def print_case_summary(results):
+  if not results:
+    return
+  slowest = max(results, key=lambda x: x["wall"])
+  highlight = sys.stdout.isatty()
+  print()
+  print("|  CASE                |  RESULT  |  WALL (s) |  USER (s) |  SYS (s)  |  MEM (KB)  |")
+  print("-------------------------------------------------------------------------------------")
+  for result in results:
+    row = "| %-20s | %8s | %9.3f | %9s | %9s | %10s |" % (
+      result["case"][:20],
+      result["verdict"],
+      result["wall"],
+      "-" if result["user"] is None else "%.3f" % result["user"],
+      "-" if result["sys"] is None else "%.3f" % result["sys"],
+      "-" if result["memory_kb"] is None else result["memory_kb"]
+    )
+    if result is slowest:
+      row = "\033[1;31m" + row + "\033[0m" if highlight else row + " <- slowest"
+    print(row)
+  print()
+
+
+"""
+Scans a python file for tokens exclusive to python 2 to infer the python version
+
+Params: A file name to scan
+Returns: An integer version of python
+"""
+def determine_python_version(file_name):
+  with open(file_name, mode="r") as f:
+    for line in f:
+      if "xrange" in line:
+        if verbose:
           print("Found occurence of \"xrange\"")
           print("Python 2 inferred\n")
         return 2
@@ -546,6 +1866,7 @@ Params: None
 Returns: None
 """
 def post():
+  global modified
   config = get_config()
   problem_id = os.path.basename(os.getcwd())
   extension = get_source_extension(problem_id)
@@ -559,21 +1880,21 @@ def post():
   # list of files to submit
   submission_files = [problem_id + extension]
   try:
-    login_response = login(config)
+    reused_login = ensure_login(config)
   except requests.exceptions.RequestException as e:
     print("Login Connection Failed:", e)
     sys.exit(0)
-  report_login_status(login_response)
   confirm_submission(problem_id, lang, submission_files)
   # try post call
   try:
-    submit_response = submit(
-      login_response.cookies,
-      problem_id,
-      lang,
-      submission_files,
-      mainclass
-    )
+    submit_response = submit(problem_id, lang, submission_files, mainclass)
+    # a saved login may have been revoked by kattis before it expired
+    if submit_response.status_code == 403 and reused_login:
+      if verbose:
+        print("Saved login rejected, logging in again...")
+      clear_cookies()
+      reused_login = ensure_login(config)
+      submit_response = submit(problem_id, lang, submission_files, mainclass)
   except requests.exceptions.RequestException as e:
     print("Submit Connection Failed:", e)
     sys.exit(0)
@@ -583,117 +1904,364 @@ def post():
   print(plain_text_response)
   # check the submission acceptance status
   submission_id = plain_text_response.split()[-1].rstrip(".")
-  check_submission_status(problem_id + extension, submission_id)
+  add_to_history(problem_id + extension)
+  user_conf.setdefault("pending", {})[submission_id] = problem_id + extension
+  # saved even if the submission is still being judged when polling gives up
+  modified = True
+  check_submission_status(problem_id + extension, submission_id, reused_login)
 
 
 """
-Checks the status of a given submission for acceptance, TLE, etc.
+Checks the status of a given submission for acceptance, TLE, etc. Polls quickly
+while judging makes progress and backs off with jitter while it doesn't, until
+the submission finishes or the timeout passes. A saved login that kattis
+rejects is replaced with a fresh one
 
-Params: A string submission_file, a string submission_id
+Params: A string submission_file or None if it isn't known, a string submission_id,
+        a bool reused_login whether the session is using a saved login
 Returns: None
 """
-def check_submission_status(submission_file, submission_id):
+def check_submission_status(submission_file, submission_id, reused_login=False):
   global modified
   print("Awaiting result...\n")
-  config = get_config()
-  # login
-  try:
-    login_response = login(config)
-  except requests.exceptions.RequestException as e:
-    print("Login Connection Failed:", e)
-    sys.exit(0)
-  # limit number of http requests for a submissions status
-  i = 0
-  while i < MAX_SUBMISSION_CHECKS:
-    response = requests.get(
-      _STATUS_URL + submission_id,
-      cookies=login_response.cookies,
-      headers=_HEADERS
-    )
-    # parse html for accepted test cases
-    soup = BeautifulSoup(response.content, "html.parser")
-    status = soup.find("td", class_=re.compile("status"))
-    if status:
-      child = status.findChildren("span")[0]
-      status = set(child["class"])
-      runtime = soup.find("td", class_=re.compile("runtime"))
+  deadline = time.monotonic() + user_conf.get("submission_timeout", SUBMISSION_TIMEOUT)
+  interval = POLL_INTERVAL
+  last_progress = None
+  while True:
+    # the session is still logged in from the submission
+    response = get_session().get(_STATUS_URL + submission_id, headers=_HEADERS)
+    # a saved login may have been revoked by kattis before it expired
+    if response.status_code == 403 and reused_login:
+      if verbose:
+        print("Saved login rejected, logging in again...")
+      clear_cookies()
+      ensure_login(get_config())
+      reused_login = False
+      continue
+    if response.status_code != 200:
+      print("URL <{}> returned non 200 status".format(response.url))
+      print("Aborting...")
+      return
+    page = parse_status_page(response.text)
+    status = page["status"]
+    progress = None
+    if status is not None:
+      accepted = page["accepted"]
       # success
       if "accepted" in status:
-        accepted = soup.find_all("span", class_=re.compile("accepted"))
         # limit length of output
-        if len(accepted) > 47:
+        if accepted > 47:
           print("Test Cases: "
                 + ("+" * 47)
                 + " plus "
-                + str(len(accepted) - 47)
+                + str(accepted - 47)
                 + " more"
           )
         else:
-          print("Test Cases: " + ("+" * len(accepted)))
+          print("Test Cases: " + ("+" * accepted))
         print("PASSED")
-        print("Runtime: %s" % runtime.text)
-        # insert problem into solved section of conf file in sorted order
-        bin_search_index = bisect(user_conf["solved"], submission_file)
-        if user_conf["solved"][bin_search_index-1] != submission_file:
-          user_conf["solved"].insert(bin_search_index, submission_file)
-        modified = True
+        print("Runtime: %s" % page["runtime"])
+        if submission_file is not None:
+          problem_id, ext = submission_file.split(".")
+          if add_solved(problem_id, ext, parse_runtime(page["runtime"])):
+            record_solve(problem_id, ext)
         break
       # failure
       elif "rejected" in status:
-        accepted = soup.find_all("span", class_=re.compile("accepted"))
-        reason = soup.find("span", class_="rejected")
-        cases = soup.find_all("span", title=re.compile("Test case"))
         num_cases = 0
         # find how many test cases passed and which one failed
-        if cases:
-          num_cases = cases[0]["title"]
-          num_cases = re.findall("[0-9]+/[0-9]+", num_cases)
+        if page["case_title"] is not None:
+          num_cases = re.findall("[0-9]+/[0-9]+", page["case_title"])
           num_cases = num_cases[0].split("/")[-1]
           # limit output length
-          if len(accepted) > 46:
+          if accepted > 46:
             print("Test Cases: " + ("+" * 44) + "...")
           else:
-            print("Test Cases: " + ("+" * len(accepted)) + "-")
+            print("Test Cases: " + ("+" * accepted) + "-")
         print("FAILED")
-        print("Reason:", reason.text)
+        print("Reason:", page["reason"])
         if num_cases == 0:
           print("Failed Test Case: N/A")
         else:
-          print("Failed Test Case: %i/%s" % (len(accepted)+1, num_cases))
-        print("Runtime: %s" % runtime.text)
+          print("Failed Test Case: %i/%s" % (accepted+1, num_cases))
+        print("Runtime: %s" % page["runtime"])
         break
       # still running
       else:
-        accepted = soup.find_all("span", class_=re.compile("accepted"))
         # update output
-        if len(accepted) > 47:
+        if accepted > 47:
           print("Test Cases: "
                 + ("+" * 47)
                 + " plus "
-                + str(len(accepted) - 47)
+                + str(accepted - 47)
                 + " more", end='\r'
           )
         else:
-          print("Test Cases: " + ("+" * len(accepted)), end='\r')
-        time.sleep(0.5)
-        i += 1
-  # add to submission history
+          print("Test Cases: " + ("+" * accepted), end='\r')
+        progress = accepted
+    # check again soon if judging moved on, otherwise back off
+    if progress != last_progress:
+      interval = POLL_INTERVAL
+    else:
+      interval = min(interval * POLL_BACKOFF, MAX_POLL_INTERVAL)
+    last_progress = progress
+    remaining = deadline - time.monotonic()
+    if remaining <= 0:
+      print()
+      print("Submission %s is still being judged" % submission_id)
+      print("Resume tracking it with: katti --status %s" % submission_id)
+      return
+    time.sleep(min(remaining, interval * random.uniform(0.5, 1.5)))
+  # no longer waiting on this submission
+  user_conf.get("pending", {}).pop(submission_id, None)
+  modified = True
+
+
+"""
+Records an accepted submission in the solved store, keeping the time the problem
+was first accepted in the language and the best runtime
+
+Params: A string problem_id, a string file extension, a float runtime in
+        seconds or None if it isn't known
+Returns: A bool, whether this is the first time the problem was solved in the language
+"""
+def add_solved(problem_id, ext, runtime):
+  global modified
+  languages = user_conf["solved"].setdefault(problem_id, {})
+  modified = True
+  if ext not in languages:
+    languages[ext] = [int(time.time()), runtime]
+    return True
+  best = languages[ext][1]
+  if runtime is not None and (best is None or runtime < best):
+    languages[ext][1] = runtime
+  return False
+
+
+"""
+Helper function to read the seconds out of a runtime like "0.05 s"
+
+Params: A string runtime
+Returns: A float, or None if there's no number in it
+"""
+def parse_runtime(runtime):
+  match = re.search(r"[0-9]+(?:\.[0-9]+)?", runtime)
+  return float(match.group()) if match else None
+
+
+"""
+Extracts the fields katti reports from a submission's status page in a single
+pass over its td and span tags, without building a document tree
+
+Params: A string page of html
+Returns: A dict with the set of status classes (None if judging hasn't started),
+         the number of accepted test cases, the runtime, the rejection reason and
+         the title of the first test case
+"""
+def parse_status_page(page):
+  status = None
+  accepted = 0
+  runtime = None
+  reason = None
+  case_title = None
+  in_status = False
+  for match in _status_tag_pattern.finditer(page):
+    _, closing, tag, attributes = match.groups()
+    if tag is None:
+      continue
+    tag = tag.lower()
+    if closing:
+      if tag == "td":
+        in_status = False
+      continue
+    classes = _get_attribute(attributes, _class_pattern).split()
+    if tag == "td":
+      if status is None and not in_status and any("status" in c for c in classes):
+        in_status = True
+      elif runtime is None and any("runtime" in c for c in classes):
+        runtime = _get_text(page, match.end(), "</td>")
+      continue
+    # the first span in the status cell holds the verdict
+    if in_status:
+      status = set(classes)
+      in_status = False
+    if reason is None and "rejected" in classes:
+      reason = _get_text(page, match.end(), "</span>")
+    # only the spans in the test case grid count as cases
+    title = _get_attribute(attributes, _title_pattern)
+    if "Test case" not in title:
+      continue
+    if any("accepted" in c for c in classes):
+      accepted += 1
+    if case_title is None:
+      case_title = title
+  return {
+    "status": status,
+    "accepted": accepted,
+    "runtime": runtime or "",
+    "reason": reason or "",
+    "case_title": case_title
+  }
+
+
+# opening and closing td and span tags, and the attributes of a tag. Comments,
+# scripts and styles are matched whole so tags inside them are passed over
+_status_tag_pattern = re.compile(
+  r"<!--.*?-->|<(script|style)\b.*?</\1\s*>|<(/?)(td|span)\b([^>]*)>",
+  re.IGNORECASE | re.DOTALL
+)
+_class_pattern = re.compile(r"""\bclass\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+_title_pattern = re.compile(r"""\btitle\s*=\s*(?:"([^"]*)"|'([^']*)'|([^\s>]+))""", re.IGNORECASE)
+_inner_tag_pattern = re.compile(r"<[^>]*>")
+
+
+"""
+Helper function for parse_status_page(). Reads one attribute from a tag's attributes
+
+Params: A string of attributes, a compiled pattern for the attribute
+Returns: The string unescaped value, or an empty string if it is missing
+"""
+def _get_attribute(attributes, pattern):
+  match = pattern.search(attributes)
+  if match is None:
+    return ""
+  return html.unescape(next(group for group in match.groups() if group is not None))
+
+
+"""
+Helper function for parse_status_page(). Gets the text of an element
+
+Params: A string page of html, an int position where the element's content
+        starts, a string closing tag
+Returns: The string text without any inner tags
+"""
+def _get_text(page, start, closing):
+  end = page.find(closing, start)
+  if end == -1:
+    end = len(page)
+  return html.unescape(_inner_tag_pattern.sub("", page[start:end]))
+
+
+"""
+Resumes tracking a submission whose result wasn't known when katti stopped polling
+
+Params: A string submission_id
+Returns: None
+"""
+def track_submission(submission_id):
+  try:
+    reused_login = ensure_login(get_config())
+  except requests.exceptions.RequestException as e:
+    print("Login Connection Failed:", e)
+    sys.exit(0)
+  check_submission_status(user_conf.get("pending", {}).get(submission_id), submission_id, reused_login)
+
+
+"""
+Adds a submission to the user's submission history
+
+Params: A string submission_file
+Returns: None
+"""
+def add_to_history(submission_file):
+  migrate_history()
+  size = user_conf["history_size"]
+  if size == 0:
+    return
   dt = str(datetime.now()).split(".")[0]
-  user_conf["history"].insert(0, dt + " " + submission_file)
-  # truncate submission history to user config history size
-  while len(user_conf["history"]) > user_conf["history_size"]:
-    user_conf["history"].pop()
+  records = append_history([dt + " " + submission_file])
+  # let the log grow to twice the history size before trimming it back down
+  if records > 2 * size:
+    trim_history(size)
+
+
+"""
+Moves a submission history kept in the user conf by older versions of katti
+into the history log
+
+Params: None
+Returns: None
+"""
+def migrate_history():
+  global modified
+  if "history" not in user_conf:
+    return
+  # the old history is newest first, the log is oldest first
+  append_history(reversed(user_conf["history"][:user_conf["history_size"]]))
+  del user_conf["history"]
   modified = True
 
 
 """
-Helper function to post a solution to kattis
+Appends entries to the end of the submission history log. Every entry is padded
+to a fixed size record so the log can be read from the tail
+
+Params: An iterable of string entries
+Returns: The number of records in the log
+"""
+def append_history(entries):
+  data = b""
+  for entry in entries:
+    record = entry.encode()[:_HISTORY_RECORD_SIZE - 1]
+    data += record.ljust(_HISTORY_RECORD_SIZE - 1) + b"\n"
+  # appends can run side by side, but not while the log is being trimmed and
+  # swapped for a new file, which would lose them
+  with lock_file(HISTORY_PATH, shared=True):
+    fd = os.open(HISTORY_PATH, os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+    try:
+      if data:
+        os.write(fd, data)
+      return os.fstat(fd).st_size // _HISTORY_RECORD_SIZE
+    finally:
+      os.close(fd)
+
+
+"""
+Reads the most recent entries of the submission history log without reading
+the rest of it
+
+Params: An int count
+Returns: A list of string entries, newest first
+"""
+def read_history(count):
+  if count <= 0 or not os.path.exists(HISTORY_PATH):
+    return []
+  with open(HISTORY_PATH, mode="rb") as f:
+    end = os.fstat(f.fileno()).st_size // _HISTORY_RECORD_SIZE * _HISTORY_RECORD_SIZE
+    start = max(0, end - count * _HISTORY_RECORD_SIZE)
+    f.seek(start)
+    data = f.read(end - start)
+  return [
+    data[i:i + _HISTORY_RECORD_SIZE].decode(errors="replace").rstrip()
+    for i in range(len(data) - _HISTORY_RECORD_SIZE, -1, -_HISTORY_RECORD_SIZE)
+  ]
+
+
+"""
+Cuts the submission history log down to its most recent entries
+
+Params: An int size
+Returns: None
+"""
+def trim_history(size):
+  with lock_file(HISTORY_PATH):
+    entries = read_history(size)
+    temp_path = HISTORY_PATH + ".%i.tmp" % os.getpid()
+    with open(temp_path, mode="wb") as f:
+      for entry in reversed(entries):
+        f.write(entry.encode().ljust(_HISTORY_RECORD_SIZE - 1) + b"\n")
+      f.flush()
+      os.fsync(f.fileno())
+    os.replace(temp_path, HISTORY_PATH)
+
+
+"""
+Helper function to post a solution to kattis with the logged in session
 
-Params: A requests cookies object for login, a string problem_id,
-        a string lang, a list files, a string mainclass
+Params: A string problem_id, a string lang, a list files, a string mainclass
 Returns: A post request object
 """
-def submit(cookies, problem_id, lang, files, mainclass=""):
+def submit(problem_id, lang, files, mainclass=""):
   data = {
     "submit": "true",
     "submit_ctr": 2,
@@ -716,7 +2284,7 @@ def submit(cookies, problem_id, lang, files, mainclass=""):
           )
         )
       )
-  return requests.post(_SUBMIT_URL, data=data, files=submission_files, cookies=cookies, headers=_HEADERS)
+  return get_session().post(_SUBMIT_URL, data=data, files=submission_files, headers=_HEADERS)
 
 
 """
@@ -790,6 +2358,7 @@ Params: None
 Returns: A ConfigParser object
 """
 def get_config():
+  import configparser
   config = configparser.ConfigParser()
   if not config.read([os.path.join(os.getenv("HOME"), ".kattisrc")]):
     print("Unable to locate .kattisrc file")
@@ -800,7 +2369,7 @@ def get_config():
 
 
 """
-A helper functiont to log a user in to kattis
+A helper functiont to log a user in to kattis with the shared session
 
 Params: A ConfigParser object config
 Returns: A requests object
@@ -812,122 +2381,762 @@ def login(config):
     "token": token,
     "script": "true"
   }
-  return requests.post(_LOGIN_URL, data=login_creds, headers=_HEADERS)
+  return get_session().post(_LOGIN_URL, data=login_creds, headers=_HEADERS)
 
 
 """
-Helper function for login. Parses a config file for username and submit token.
-On failure to parse config file, exits control flow
+Makes sure the shared session is logged in, reusing the cookies saved by an
+earlier login if they belong to the same user and haven't expired
 
-Params: A ConfigParser object
-Returns: A tuple of username and token
+Params: A ConfigParser object config
+Returns: A bool, True if a saved login was reused
 """
-def parse_config(config):
-  username = config.get("user", "username")
-  token = None
+def ensure_login(config):
+  username, _ = parse_config(config)
+  if load_cookies(username):
+    if verbose:
+      print("Reusing saved login\n")
+    return True
+  login_response = login(config)
+  report_login_status(login_response)
+  save_cookies(username)
+  return False
+
+
+"""
+Helper function for ensure_login(). Loads saved login cookies into the shared session
+
+Params: A string username the cookies must belong to
+Returns: A bool, True if valid cookies were loaded
+"""
+def load_cookies(username):
+  if not os.path.exists(COOKIES_PATH):
+    return False
   try:
-    token = config.get("user", "token")
-  except configparser.NoOptionError:
-    pass
-  if token is None:
-    print("Corrupted .katisrc file")
-    print("Please navigate to https://open.kattis.com/help/submit and download a new .kattisrc")
-    print("Aborting...")
-    sys.exit(0)
-  return (username, token)
+    with open(COOKIES_PATH) as f:
+      saved = json.load(f)
+  except ValueError:
+    return False
+  now = time.time()
+  if saved.get("user") != username or now - saved.get("created", 0) >= LOGIN_LIFETIME * 3600:
+    return False
+  cookies = [c for c in saved.get("cookies", []) if c["expires"] is None or c["expires"] > now]
+  if not cookies:
+    return False
+  for c in cookies:
+    get_session().cookies.set(c["name"], c["value"], domain=c["domain"], path=c["path"], expires=c["expires"])
+  return True
 
 
 """
-A helper function to print a users submission stats
+Helper function for ensure_login(). Saves the shared session's cookies, readable only by the user
 
-Params: None
+Params: A string username the cookies belong to
+Returns: None
+"""
+def save_cookies(username):
+  saved = {
+    "user": username,
+    "created": time.time(),
+    "cookies": [
+      {
+        "name": c.name,
+        "value": c.value,
+        "domain": c.domain,
+        "path": c.path,
+        "expires": c.expires
+      }
+      for c in get_session().cookies
+    ]
+  }
+  # swap the new cookies in so a concurrent katti never reads half a file
+  temp_path = COOKIES_PATH + ".%i.tmp" % os.getpid()
+  fd = os.open(temp_path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+  with os.fdopen(fd, mode="w") as f:
+    f.write(json.dumps(saved))
+  os.replace(temp_path, COOKIES_PATH)
+
+
+"""
+Forgets the saved login cookies
+
+Params: None
+Returns: None
+"""
+def clear_cookies():
+  get_session().cookies.clear()
+  if os.path.exists(COOKIES_PATH):
+    os.remove(COOKIES_PATH)
+
+
+"""
+Helper function for login. Parses a config file for username and submit token.
+On failure to parse config file, exits control flow
+
+Params: A ConfigParser object
+Returns: A tuple of username and token
+"""
+def parse_config(config):
+  import configparser
+  username = config.get("user", "username")
+  token = None
+  try:
+    token = config.get("user", "token")
+  except configparser.NoOptionError:
+    pass
+  if token is None:
+    print("Corrupted .katisrc file")
+    print("Please navigate to https://open.kattis.com/help/submit and download a new .kattisrc")
+    print("Aborting...")
+    sys.exit(0)
+  return (username, token)
+
+
+"""
+A helper function to print a users submission stats from the aggregates kept
+in the user config, so the cost doesn't grow with the number of solved problems
+
+Params: None
 Returns: None
 """
 def get_stats():
   if len(user_conf["solved"]) == 0:
     print("You haven't solved any problems yet!")
     return
-  solved = user_conf["solved"]
-  # last updated
-  prev_update = datetime.strptime(user_conf["ids_last_updated"], "%Y-%m-%d %H:%M:%S.%f")
-  current = datetime.now()
-  # 3600 seconds in hour - no hours field
-  hours = (current - prev_update).total_seconds() / 3600
-  if hours >= user_conf["ratings_update_period"]:
-    get_updated_ratings()
-  # temporary record for various stats tracked
-  stats = {
-    "cpp": {
-      "freq": 0,
-      "pr": (None, 0),
-      "ratings": []
-    },
-    "java": {
-      "freq": 0,
-      "pr": (None, 0),
-      "ratings": []
-    },
-    "py": {
-      "freq": 0,
-      "pr": (None, 0),
-      "ratings": []
-    }
-  }
-  for prob in solved:
-    problem_id, ext = prob.split(".")
-    if ext not in stats:
-      continue
-    stats[ext]["freq"] += 1
-    stats[ext]["ratings"].append(problems_conf[problem_id])
-    if problems_conf[problem_id] > stats[ext]["pr"][1]:
-      stats[ext]["pr"] = (problem_id, problems_conf[problem_id])
-  # for getting averages and personal bests (language specific)
-  cpp_num, cpp_denom = sum(stats["cpp"]["ratings"]), len(stats["cpp"]["ratings"])
-  java_num, java_denom = sum(stats["java"]["ratings"]), len(stats["java"]["ratings"])
-  py_num, py_denom = sum(stats["py"]["ratings"]), len(stats["py"]["ratings"])
-  cpp_avg, cpp_pr = cpp_num / cpp_denom, stats["cpp"]["pr"]
-  java_avg, java_pr = java_num / java_denom, stats["java"]["pr"]
-  py_avg, py_pr = py_num / py_denom, stats["py"]["pr"]
-  # total stats
-  total_num, total_denom = (cpp_num + java_num + py_num), (cpp_denom + java_denom + py_denom)
-  avg, pr = total_num / total_denom, max(cpp_pr, java_pr, py_pr, key=lambda x: x[1])
+  # only the solved problems' ratings matter here
+  cutoff = time.time() - user_conf["ratings_update_period"] * 3600
+  refresh_ratings({problem for problem in problems_conf.stale(cutoff) if is_solved(problem)})
+  stats = get_stats_state()
+  total = new_language_stats()
+  for ext in _stats_languages:
+    merge_language_stats(total, stats[ext])
   print()
   print("|  LANGUAGE  |   SOLVED   | AVG RATING |               PR               |")
   print("-------------------------------------------------------------------------")
-  print("| C++        | %10i | %10.2f | %-26s %3.1f |" % (cpp_denom, cpp_avg, cpp_pr[0], cpp_pr[1]))
-  print("| Java       | %10i | %10.2f | %-26s %3.1f |" % (java_denom, java_avg, java_pr[0], java_pr[1]))
-  print("| Python     | %10i | %10.2f | %-26s %3.1f |" % (py_denom, py_avg, py_pr[0], py_pr[1]))
+  for ext, name in _stats_languages.items():
+    print_language_stats(name, stats[ext])
   print("-------------------------------------------------------------------------")
-  print("| TOTAL      | %10i | %10.2f | %-26s %3.1f |" % (total_denom, avg, pr[0], pr[1]))
+  print_language_stats("TOTAL", total)
+  print()
+  print("|  LANGUAGE  |    P25     |    P50     |    P75     |    P90     |")
+  print("-----------------------------------------------------------------")
+  for ext, name in _stats_languages.items():
+    print_language_percentiles(name, stats[ext])
+  print("-----------------------------------------------------------------")
+  print_language_percentiles("TOTAL", total)
+  print()
+  print("| RATING | SOLVED")
+  print("-----------------")
+  buckets = {}
+  for rating, count in total["histogram"].items():
+    bucket = int(float(rating))
+    buckets[bucket] = buckets.get(bucket, 0) + count
+  # solves whose problems aren't in the catalog have no rating to count
+  most = max(buckets.values(), default=0)
+  for bucket in range(1, 11):
+    count = buckets.get(bucket, 0)
+    print("| %4i.x | %-4i %s" % (bucket, count, "█" * int(40 * count / most) if most else ""))
+
+
+# languages tracked in the stats, by solution file extension
+_stats_languages = {
+  "cpp": "C++",
+  "java": "Java",
+  "py": "Python"
+}
+
+
+"""
+Helper function for get_stats(). Prints a language's row of the stats table
+
+Params: A string name, a dict of language stats
+Returns: None
+"""
+def print_language_stats(name, stats):
+  if stats["solved"] == 0:
+    print("| %-10s | %10i | %10s | %-26s %3s |" % (name, 0, "-", "-", "-"))
+    return
+  print("| %-10s | %10i | %10.2f | %-26s %3.1f |" % (
+    name,
+    stats["solved"],
+    stats["total"] / stats["solved"],
+    stats["pr"][0],
+    stats["pr"][1]
+  ))
+
+
+"""
+Helper function for get_stats(). Prints a language's row of the percentiles table
+
+Params: A string name, a dict of language stats
+Returns: None
+"""
+def print_language_percentiles(name, stats):
+  if stats["solved"] == 0:
+    print("| %-10s | %10s | %10s | %10s | %10s |" % (name, "-", "-", "-", "-"))
+    return
+  print("| %-10s | %10.1f | %10.1f | %10.1f | %10.1f |" % (
+    (name,) + tuple(get_percentile(stats, p) for p in (25, 50, 75, 90))
+  ))
+
+
+"""
+Finds a percentile of a language's solved ratings from its rating histogram
+
+Params: A dict of language stats, an int percentile
+Returns: A float rating
+"""
+def get_percentile(stats, percentile):
+  rank = percentile / 100 * stats["solved"]
+  seen = 0
+  for rating in sorted(stats["histogram"], key=float):
+    seen += stats["histogram"][rating]
+    if seen >= rank:
+      return float(rating)
+  return stats["pr"][1]
+
+
+"""
+Gets the per language stats kept in the user config, building them from the
+solved problems the first time
+
+Params: None
+Returns: A dict of file extensions to language stats
+"""
+def get_stats_state():
+  global modified
+  if "stats" not in user_conf:
+    if problems_conf is None:
+      load_problems_conf()
+    stats = {ext: new_language_stats() for ext in _stats_languages}
+    for problem_id, languages in user_conf["solved"].items():
+      if problem_id not in problems_conf:
+        continue
+      for ext in languages:
+        if ext in stats:
+          add_language_stats(stats[ext], problem_id, problems_conf[problem_id])
+    user_conf["stats"] = stats
+    modified = True
+  return user_conf["stats"]
+
+
+"""
+Helper function to create empty stats for a language
+
+Params: None
+Returns: A dict of language stats
+"""
+def new_language_stats():
+  return {
+    "solved": 0,
+    "total": 0,
+    "pr": [None, 0],
+    "histogram": {}
+  }
+
+
+"""
+Helper function to count a solved problem in a language's stats
+
+Params: A dict of language stats, a string problem_id, a float rating
+Returns: None
+"""
+def add_language_stats(stats, problem_id, rating):
+  key = "%.1f" % rating
+  stats["solved"] += 1
+  stats["total"] = round(stats["total"] + rating, 1)
+  stats["histogram"][key] = stats["histogram"].get(key, 0) + 1
+  if rating > stats["pr"][1]:
+    stats["pr"] = [problem_id, rating]
+
+
+"""
+Helper function to stop counting a solved problem in a language's stats
+
+Params: A dict of language stats, a float rating
+Returns: None
+"""
+def remove_language_stats(stats, rating):
+  key = "%.1f" % rating
+  # a problem that was never counted has nothing to remove
+  if key not in stats["histogram"]:
+    return
+  stats["solved"] -= 1
+  stats["total"] = round(stats["total"] - rating, 1)
+  stats["histogram"][key] -= 1
+  if stats["histogram"][key] == 0:
+    del stats["histogram"][key]
+
+
+"""
+Helper function to add one language's stats into another's
+
+Params: A dict of language stats to add to, a dict of language stats
+Returns: None
+"""
+def merge_language_stats(total, stats):
+  total["solved"] += stats["solved"]
+  total["total"] = round(total["total"] + stats["total"], 1)
+  for key, count in stats["histogram"].items():
+    total["histogram"][key] = total["histogram"].get(key, 0) + count
+  if stats["pr"][1] > total["pr"][1]:
+    total["pr"] = list(stats["pr"])
+
+
+"""
+Counts a newly accepted problem in the stats
+
+Params: A string problem_id, a string file extension
+Returns: None
+"""
+def record_solve(problem_id, ext):
+  global modified
+  if problems_conf is None:
+    load_problems_conf()
+  if problem_id not in problems_conf:
+    rating, updated = get_problem_rating(problem_id)
+    problems_conf.add(problem_id, float(rating), updated)
+  # building the stats from scratch already counts the new problem
+  if "stats" not in user_conf:
+    get_stats_state()
+    return
+  if ext in user_conf["stats"]:
+    add_language_stats(user_conf["stats"][ext], problem_id, problems_conf[problem_id])
+    modified = True
+
+
+"""
+Applies new ratings to the catalog, moving solved problems between the buckets
+of the stats as their ratings change
+
+Params: An iterable of (problem_id, rating, updated) tuples
+Returns: None
+"""
+def apply_ratings(records):
+  global modified
+  records = list(records)
+  if "stats" in user_conf:
+    stats = user_conf["stats"]
+    for problem_id, rating, _ in records:
+      if problem_id not in problems_conf:
+        continue
+      old = problems_conf[problem_id]
+      if old == rating:
+        continue
+      for ext in get_solved_languages(problem_id):
+        if ext not in stats:
+          continue
+        remove_language_stats(stats[ext], old)
+        add_language_stats(stats[ext], problem_id, rating)
+        # a personal record that got easier may no longer be the hardest solve
+        if stats[ext]["pr"][0] == problem_id and rating < old:
+          if float(max(stats[ext]["histogram"], key=float)) > rating:
+            del user_conf["stats"]
+            break
+          stats[ext]["pr"][1] = rating
+      modified = True
+  problems_conf.update_ratings(records)
+  # rebuilt once the new ratings are in
+  if "stats" not in user_conf:
+    get_stats_state()
+
+
+"""
+Finds every language a problem was solved in
+
+Params: A string problem_id
+Returns: A list of string file extensions
+"""
+def get_solved_languages(problem_id):
+  return list(user_conf["solved"].get(problem_id, ()))
 
 
 """
-Helper to get floating point problem rating rather than string
+Helper to get floating point problem rating rather than string during a
+refresh, retrying transient failures with exponential backoff
 
 Params: A string problem_id
-Returns: A float representing the rating
+Returns: A float representing the rating, None if a transient failure outlasted
+         the retries, or the KattisError if retrying won't help, like a problem
+         that's gone or a page without a difficulty
 """
 def get_numeric_rating(problem_id):
-  return float(get_problem_rating(problem_id))
+  for attempt in range(REFRESH_RETRIES + 1):
+    try:
+      return float(fetch_problem_rating(problem_id))
+    except KattisError as e:
+      if e.status_code not in _transient_statuses:
+        return e
+    except requests.exceptions.RequestException:
+      pass
+    if attempt < REFRESH_RETRIES:
+      time.sleep(REFRESH_BACKOFF * 2 ** attempt * (1 + random.random()))
+  return None
+
+
+"""
+Refreshes the ratings of the given problems that have gone stale, then starts a
+full refresh in the background if the user has opted in and one is due
+
+Params: A set of string problem ids
+Returns: None
+"""
+def refresh_ratings(problem_ids):
+  get_updated_ratings(problem_ids)
+  if user_conf.get("background_refresh") and rating_expired(None):
+    start_background_refresh()
+
+
+"""
+Checks whether a problem's rating is older than the update period. Problems
+never refreshed on their own fall back to the time of the last full refresh
+
+Params: A string problem_id, or None for the last full refresh
+Returns: A bool
+"""
+def rating_expired(problem_id):
+  updated = problems_conf.get_updated(problem_id) if problem_id is not None else None
+  if updated is None:
+    prev_update = datetime.strptime(user_conf["ids_last_updated"], "%Y-%m-%d %H:%M:%S.%f")
+    updated = prev_update.timestamp()
+  # 3600 seconds in hour - no hours field
+  return (time.time() - updated) / 3600 >= user_conf["ratings_update_period"]
 
 
 """
-Gets up to date problem ratings with multiprocessed calls to kattis
+Starts a detached katti process that refreshes every stale rating
+
+Params: None
+Returns: None
 """
-def get_updated_ratings():
+def start_background_refresh():
+  # a refresh that's still running would only make this one skip
+  with try_lock_file(REFRESH_CHECKPOINT_PATH) as locked:
+    if not locked:
+      return
+  subprocess.Popen(
+    [sys.executable, os.path.abspath(__file__), "--update_ratings"],
+    stdin=subprocess.DEVNULL,
+    stdout=subprocess.DEVNULL,
+    stderr=subprocess.DEVNULL,
+    start_new_session=True
+  )
+
+
+"""
+Gets up to date problem ratings with concurrent calls to kattis over a shared
+session. Only ratings older than the update period are requested, and each
+problem's update time is tracked on its own. The number of concurrent requests
+and the requests per second are set by the user config. Ratings are checkpointed
+to disk as they arrive, so an interrupted or partially failed refresh resumes
+with only the remaining problems, and they are merged into the problems conf
+only once every problem is done. Only one katti process updates ratings at a
+time, any other skips its update
+
+Params: An iterable of string problem_ids to refresh, defaults to every problem
+Returns: None
+"""
+def get_updated_ratings(problem_ids=None):
+  with try_lock_file(REFRESH_CHECKPOINT_PATH) as locked:
+    if not locked:
+      print("Ratings are already being updated by another katti process, skipping...")
+      return
+    run_rating_update(problem_ids)
+
+
+"""
+Helper function for get_updated_ratings(). Refreshes the ratings while holding
+the lock on the checkpoint
+
+Params: An iterable of string problem_ids to refresh, or None for every problem
+Returns: None
+"""
+def run_rating_update(problem_ids):
   global modified
-  # updated values
-  user_conf["ids_last_updated"] = str(datetime.now())
-  ordered_keys = list(problems_conf.keys())
-  # can tinker with this value if needed
-  pool = mp.Pool(processes=128)
-  print("Getting up-to-date problem ratings...")
-  for i, val in enumerate(pool.imap(get_numeric_rating, ordered_keys)):
-    print("\rStatus: [" + "%-40s" % ("█" * int(40 * i / len(ordered_keys))) + "] %.1f%%" % (100 * i / len(ordered_keys)), end="")
-    problems_conf[ordered_keys[i]] = val
-  print("\rStatus: [%-40s" % ("█" * 40) + "] 100.0%")
-  pool.close()
-  pool.join()
+  full = problem_ids is None
+  if full:
+    problem_ids = problems_conf.keys()
+  ordered_keys = [k for k in problem_ids if k in problems_conf and rating_expired(k)]
+  if not ordered_keys:
+    if full:
+      user_conf["ids_last_updated"] = str(datetime.now())
+      modified = True
+    return
+  records = load_refresh_checkpoint()
+  remaining = [k for k in ordered_keys if k not in records]
+  workers = user_conf.get("refresh_workers", DEFAULT_REFRESH_WORKERS)
+  limiter = RateLimiter(user_conf.get("refresh_rate_limit", DEFAULT_REFRESH_RATE_LIMIT))
+  def fetch(problem_id):
+    limiter.wait()
+    return get_numeric_rating(problem_id)
+  if len(remaining) < len(ordered_keys):
+    print("Resuming rating update, %i of %i problems remaining..." % (len(remaining), len(ordered_keys)))
+  else:
+    print("Getting up-to-date ratings for %i problems..." % len(ordered_keys))
+  failed = []
+  unrated = []
+  start = time.monotonic()
+  import concurrent.futures
+  pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers)
+  try:
+    with open(REFRESH_CHECKPOINT_PATH, mode="a") as checkpoint:
+      if not records:
+        checkpoint.write(json.dumps({"started": str(datetime.now())}) + "\n")
+      for i, val in enumerate(pool.map(fetch, remaining), 1):
+        problem_id = remaining[i-1]
+        if val is None:
+          failed.append(problem_id)
+        else:
+          # asking again won't help, so the old rating stays until the next period
+          if isinstance(val, KattisError):
+            unrated.append(problem_id)
+            val = problems_conf[problem_id]
+          records[problem_id] = {"id": problem_id, "rating": val, "updated": int(time.time())}
+          checkpoint.write(json.dumps(records[problem_id]) + "\n")
+          checkpoint.flush()
+        done = len(ordered_keys) - len(remaining) + i
+        rate = i / max(time.monotonic() - start, 1e-9)
+        print("\rStatus: [" + "%-40s" % ("█" * int(40 * done / len(ordered_keys))) + "] %.1f%% (%.1f req/s)" % (100 * done / len(ordered_keys), rate), end="")
+  except KeyboardInterrupt:
+    pool.shutdown(wait=False, cancel_futures=True)
+    print()
+    print("Rating update interrupted, progress saved and will resume next time")
+    sys.exit(0)
+  pool.shutdown()
+  print()
+  if unrated:
+    print("Kattis gave no rating for %i problems, keeping their old ratings" % len(unrated))
+    if verbose:
+      print("Unrated:", ", ".join(unrated))
+  if failed:
+    print("Unable to get ratings for %i problems, they will be retried next time" % len(failed))
+    if verbose:
+      print("Failed:", ", ".join(failed))
+    return
+  # every rating is in, swap them all in at once
+  apply_ratings((r["id"], r["rating"], r["updated"]) for r in records.values())
+  if full:
+    user_conf["ids_last_updated"] = str(datetime.now())
+  # another katti process may have finished the same refresh first
+  with contextlib.suppress(FileNotFoundError):
+    os.remove(REFRESH_CHECKPOINT_PATH)
+  modified = True
+
+
+"""
+Helper function for get_updated_ratings(). Loads the ratings saved by an
+unfinished refresh, discarding checkpoints older than the update period
+
+Params: None
+Returns: A dict of problem ids to checkpoint records
+"""
+def load_refresh_checkpoint():
+  records = {}
+  if not os.path.exists(REFRESH_CHECKPOINT_PATH):
+    return records
+  with open(REFRESH_CHECKPOINT_PATH) as f:
+    for line in f:
+      try:
+        record = json.loads(line)
+      except ValueError:
+        # the last line may have been cut short by a crash
+        continue
+      if "started" in record:
+        started = datetime.strptime(record["started"], "%Y-%m-%d %H:%M:%S.%f")
+        if (datetime.now() - started).total_seconds() / 3600 >= user_conf["ratings_update_period"]:
+          os.remove(REFRESH_CHECKPOINT_PATH)
+          return {}
+      else:
+        records[record["id"]] = record
+  return records
+
+
+"""
+Writes a JSON document by writing a temporary file beside it, flushing it to
+disk and renaming it over the original, so the file is never left half written
+
+Params: A string path, a JSON serializable object data
+Returns: None
+"""
+def write_json(path, data):
+  temp_path = path + ".%i.tmp" % os.getpid()
+  with open(temp_path, mode="w") as f:
+    f.write(json.dumps(data))
+    f.flush()
+    os.fsync(f.fileno())
+  os.replace(temp_path, path)
+  # make the rename itself durable
+  directory = os.open(os.path.dirname(path) or ".", os.O_RDONLY)
+  try:
+    os.fsync(directory)
+  finally:
+    os.close(directory)
+
+
+"""
+Holds a lock on a lock file beside a path, so katti processes running at the
+same time take turns updating it. Any number of processes can hold a shared lock
+at once, but only while nobody holds the exclusive one
+
+Params: A string path, a bool shared
+Returns: A context manager
+"""
+@contextlib.contextmanager
+def lock_file(path, shared=False):
+  with open(path + ".lock", mode="a") as f:
+    fcntl.flock(f, fcntl.LOCK_SH if shared else fcntl.LOCK_EX)
+    try:
+      yield
+    finally:
+      fcntl.flock(f, fcntl.LOCK_UN)
+
+
+"""
+Takes an exclusive lock on a lock file beside a path without waiting for it
+
+Params: A string path
+Returns: A context manager giving a bool, whether the lock was taken
+"""
+@contextlib.contextmanager
+def try_lock_file(path):
+  with open(path + ".lock", mode="a") as f:
+    try:
+      fcntl.flock(f, fcntl.LOCK_EX | fcntl.LOCK_NB)
+    except BlockingIOError:
+      yield False
+      return
+    try:
+      yield True
+    finally:
+      fcntl.flock(f, fcntl.LOCK_UN)
+
+
+"""
+Loads the user conf, or a fresh one if it doesn't exist yet, and remembers
+how it looked so only what this process changes is written back
+
+Params: None
+Returns: None
+"""
+def load_user_conf():
+  global user_conf, _user_conf_snapshot
+  if os.path.exists(USER_CONF_PATH):
+    with open(USER_CONF_PATH) as f:
+      user_conf = json.load(f)
+  else:
+    user_conf = {
+      "solved": {},
+      "history_size": DEFAULT_HIST_SIZE,
+      "ids_last_updated": str(datetime.now()),
+      "ratings_update_period": 72
+    }
+    # nothing on disk yet, so every key counts as changed
+    _user_conf_snapshot = {}
+    return
+  _user_conf_snapshot = json.loads(json.dumps(user_conf))
+  migrate_solved()
+
+
+"""
+Converts the sorted list of "id.ext" solves kept by older versions of katti into
+the solved store, a dict of problem ids to dicts of file extensions to the time
+the problem was first accepted in that language and the best runtime. Neither
+is known for the old solves
+
+Params: None
+Returns: None
+"""
+def migrate_solved():
+  global modified
+  if not isinstance(user_conf["solved"], list):
+    return
+  solved = {}
+  for prob in user_conf["solved"]:
+    problem_id, ext = prob.split(".")
+    solved.setdefault(problem_id, {})[ext] = [None, None]
+  user_conf["solved"] = solved
+  modified = True
+
+
+"""
+Writes what this process changed in the user conf over the latest copy on disk,
+under a lock, so changes another katti process saved in the meantime are kept.
+Changes inside dicts such as the solved problems and pending submissions are
+applied entry by entry. The file is replaced atomically
+
+Params: None
+Returns: None
+"""
+def save_user_conf():
+  with lock_file(USER_CONF_PATH):
+    current = {}
+    if os.path.exists(USER_CONF_PATH):
+      with open(USER_CONF_PATH) as f:
+        current = json.load(f)
+    # the stats are totals over the solves, so when both processes changed them
+    # they're rebuilt from the merged solves instead
+    base_stats = _user_conf_snapshot.get("stats")
+    stats_conflict = current.get("stats") != base_stats and user_conf.get("stats") != base_stats
+    merge_user_conf(current, _user_conf_snapshot, user_conf)
+    if stats_conflict:
+      current.pop("stats", None)
+    write_json(USER_CONF_PATH, current)
+
+
+"""
+Helper function for save_user_conf(). Applies the differences between two
+versions of a dict to a third, descending into dicts that are dicts in all three
+
+Params: A dict to change, a dict as it was loaded, a dict as it is now
+Returns: None
+"""
+def merge_user_conf(current, loaded, changed):
+  for k in set(loaded) | set(changed):
+    if k not in changed:
+      current.pop(k, None)
+    elif k not in loaded or changed[k] != loaded[k]:
+      if all(isinstance(d.get(k), dict) for d in (current, loaded, changed)):
+        merge_user_conf(current[k], loaded[k], changed[k])
+      else:
+        current[k] = changed[k]
+
+
+"""
+Sets the maximum number of requests per second made when refreshing ratings
+
+Params: A string rate, 0 meaning unlimited
+Returns: None
+"""
+def set_rate_limit(rate):
+  global modified
+  invalid = False
+  try:
+    rate = float(rate)
+  except ValueError:
+    invalid = True
+  if invalid or rate < 0:
+    print("Invalid rate limit. Must be a number of requests per second >= 0 (0 is unlimited)")
+    print("Aborting...")
+    sys.exit(0)
+  user_conf["refresh_rate_limit"] = rate
+  modified = True
+
+
+"""
+Sets whether --stats and --random start a full rating update in the background
+when one is due
+
+Params: A string setting, either on or off
+Returns: None
+"""
+def set_background_refresh(setting):
+  global modified
+  setting = setting.lower()
+  if setting not in {"on", "off"}:
+    print("Invalid background refresh setting. Must be on or off")
+    print("Aborting...")
+    sys.exit(0)
+  user_conf["background_refresh"] = setting == "on"
   modified = True
 
 
@@ -938,7 +3147,9 @@ Params: None
 Returns: None
 """
 def get_history():
-  if len(user_conf["history"]) == 0:
+  migrate_history()
+  history = read_history(user_conf["history_size"])
+  if len(history) == 0:
     if user_conf["history_size"] == 0:
       print("You currently aren't tracking your submission history because your history size is 0")
     else:
@@ -947,7 +3158,7 @@ def get_history():
   print()
   print(" #    | YYYY-MM-DD HH:MM:SS | SUBMISSION")
   print("-----------------------------------------------------")
-  for i, submission in enumerate(user_conf["history"], 1):
+  for i, submission in enumerate(history, 1):
     d, t, sub = submission.split(" ")
     print(" %-4i | %s %s | %-24s" % (i, d, t, sub))
   print()
@@ -970,9 +3181,9 @@ def set_history_size(size):
     ans = input("Do you wish to continue? (Y/N): ")
     if ans.lower() not in {"y", "yes"}:
       return
+  migrate_history()
   user_conf["history_size"] = size
-  while len(user_conf["history"]) > size:
-    user_conf["history"].pop()
+  trim_history(size)
   modified = True
 
 
@@ -1010,42 +3221,63 @@ def handle_history_size(size):
 
 
 """
-Gets a random kattis problem within a range, [rating, rating + 0.9]
+Gets a random unsolved kattis problem within a range of ratings. A whole number
+N picks from [N, N + 1), so 4 covers 4.0 - 4.9, and lo-hi picks from [lo, hi)
 
-Params: An int rating
+Params: A string rating, either a whole number or a range like 3.5-4.2
 Returns: None
 """
 def get_random(rating):
-  global modified
-  invalid = False
+  lo, hi = parse_rating_range(rating)
+  # update ratings in this range if necessary
+  refresh_ratings({problem for problem, _ in problems_conf.in_range(lo, hi)})
+  # the rating index hands back just the problems in range
+  choices = [problem for problem, _ in problems_conf.in_range(lo, hi)]
+  # draw without replacement until an unsolved problem turns up
+  while choices:
+    i = random.randrange(len(choices))
+    choices[i], choices[-1] = choices[-1], choices[i]
+    pick = choices.pop()
+    if not is_solved(pick):
+      print("Getting %s..." % pick)
+      get([pick])
+      return
+  print("It appears you have solved all problems rated %.1f - %.1f" % (lo, hi - 0.1))
+
+
+"""
+Helper function for get_random(). Parses a rating or range of ratings
+
+Params: A string rating, either a whole number or a range like 3.5-4.2
+Returns: A tuple of float bounds lo and hi, where lo <= rating < hi
+"""
+def parse_rating_range(rating):
   try:
-    rating = int(rating)
-  except:
-    invalid = True
-  if rating < 1 or rating >= 10 or invalid:
-    print("Invalid rating. Rating must be a valid integer between 1 and 10")
+    if "-" in rating:
+      lo, hi = (float(bound) for bound in rating.split("-"))
+    else:
+      lo = int(rating)
+      hi = lo + 1
+  except ValueError:
+    lo, hi = 0, 0
+  if lo < 1 or hi > 10 or lo >= hi:
+    print("Invalid rating. Rating must be a valid integer between 1 and 10, or a range like 3.5-4.2")
     print("Aborting...")
     sys.exit(0)
-  # update ratings if necessary
-  prev_update = datetime.strptime(user_conf["ids_last_updated"], "%Y-%m-%d %H:%M:%S.%f")
-  current = datetime.now()
-  # 3600 seconds in hour - no hours field
-  hours = (current - prev_update).total_seconds() / 3600
-  if hours >= user_conf["ratings_update_period"]:
-    get_updated_ratings()
-  # will hold all unsolved problems within the range
-  choices = set()
-  solved = set([i.split(".")[0] for i in user_conf["solved"]])
-  for problem, val in problems_conf.items():
-    if val == rating:
-      choices.add(problem)
-  choices -= solved
-  if choices:
-    pick = random.choice(list(choices))
-    print("Getting %s..." % pick)
-    get(pick)
-    return
-  print("It appears you have solved all problems rated %.1f - %.1f" % (rating, rating + 0.9))
+  return (lo, hi)
+
+
+"""
+Checks whether a problem has been solved, in any language or in a given one
+
+Params: A string problem_id, optionally a string file extension
+Returns: A bool
+"""
+def is_solved(problem_id, ext=None):
+  languages = user_conf["solved"].get(problem_id)
+  if languages is None:
+    return False
+  return ext is None or ext in languages
 
 
 """
@@ -1077,64 +3309,200 @@ Params: None
 Returns: a string representing the usage message
 """
 def usage_msg():
-  return "katti [-g <problem-id>] [-r] [-p] [-h] [-v]"
+  return "katti [-g <problem-id> ...] [-r [-j <n>] [-c <mode>] [--json] [--watch]] [-p] [-h] [-v]"
+
+
+"""
+Opens the problem catalog, which only commands that deal with problem ids need.
+The first time it runs the catalog is built from the problem ids JSON file
+
+Params: None
+Returns: None
+"""
+def load_problems_conf():
+  global problems_conf
+  if not os.path.exists(CATALOG_PATH):
+    # should have been downloaded with katti
+    if not os.path.exists(PROBLEMS_CONF_PATH):
+      print("Your problem ids JSON file appears to be corrupted")
+      print("Please download and install a new one at https://github.com/andrewjmcgehee/katti-automation")
+      print("Aborting...")
+      sys.exit(0)
+    migrate_problems_conf()
+  problems_conf = ProblemCatalog(CATALOG_PATH)
+
+
+"""
+Builds the problem catalog from the problem ids JSON file, carrying over the
+time each rating was last updated. The catalog is built beside its final path
+and renamed into place so an interrupted migration simply runs again
+
+Params: None
+Returns: None
+"""
+def migrate_problems_conf():
+  global modified
+  import sqlite3
+  if verbose:
+    print("Building problem catalog from %s..." % PROBLEMS_CONF_PATH)
+  with open(PROBLEMS_CONF_PATH) as f:
+    ratings = json.load(f)
+  default = datetime.strptime(user_conf["ids_last_updated"], "%Y-%m-%d %H:%M:%S.%f").timestamp()
+  updated = user_conf.get("ratings_updated", {})
+  temp_path = CATALOG_PATH + ".%i.tmp" % os.getpid()
+  connection = sqlite3.connect(temp_path)
+  with connection:
+    connection.executescript(_CATALOG_SCHEMA)
+    connection.executemany(
+      "INSERT INTO problems (id, rating, updated) VALUES (?, ?, ?)",
+      ((k, v, int(updated.get(k, default))) for k, v in ratings.items())
+    )
+  connection.close()
+  os.replace(temp_path, CATALOG_PATH)
+  # update times now live in the catalog
+  if "ratings_updated" in user_conf:
+    del user_conf["ratings_updated"]
+    modified = True
+
+
+_CATALOG_SCHEMA = """
+CREATE TABLE problems (
+  id TEXT PRIMARY KEY,
+  rating REAL NOT NULL,
+  updated INTEGER NOT NULL
+) WITHOUT ROWID;
+CREATE INDEX problems_by_rating ON problems (rating);
+CREATE INDEX problems_by_updated ON problems (updated);
+"""
+
+
+"""
+The problem catalog, a SQLite table of problem ids, their ratings and when each
+rating was last updated, indexed by id and by rating. Reads like a dict of
+problem ids to ratings, and every write is its own transaction
+"""
+class ProblemCatalog:
+  def __init__(self, path):
+    import sqlite3
+    self.connection = sqlite3.connect(path)
+
+  def __contains__(self, problem_id):
+    return self.connection.execute("SELECT 1 FROM problems WHERE id = ?", (problem_id,)).fetchone() is not None
+
+  def __getitem__(self, problem_id):
+    row = self.connection.execute("SELECT rating FROM problems WHERE id = ?", (problem_id,)).fetchone()
+    if row is None:
+      raise KeyError(problem_id)
+    return row[0]
+
+  def __len__(self):
+    return self.connection.execute("SELECT COUNT(*) FROM problems").fetchone()[0]
+
+  # problem ids in sorted order
+  def keys(self):
+    return [row[0] for row in self.connection.execute("SELECT id FROM problems ORDER BY id")]
+
+  def items(self):
+    return self.connection.execute("SELECT id, rating FROM problems ORDER BY id").fetchall()
+
+  # when a problem's rating was last updated, in seconds since the epoch
+  def get_updated(self, problem_id):
+    row = self.connection.execute("SELECT updated FROM problems WHERE id = ?", (problem_id,)).fetchone()
+    return None if row is None else row[0]
+
+  # ids of problems whose ratings were last updated before a cutoff
+  def stale(self, cutoff):
+    return [row[0] for row in self.connection.execute("SELECT id FROM problems WHERE updated < ?", (cutoff,))]
+
+  # (id, rating) pairs with lo <= rating < hi, in order of rating
+  def in_range(self, lo, hi):
+    return self.connection.execute(
+      "SELECT id, rating FROM problems WHERE rating >= ? AND rating < ? ORDER BY rating",
+      (lo, hi)
+    ).fetchall()
+
+  # adds a problem or replaces its rating
+  def add(self, problem_id, rating, updated):
+    with self.connection:
+      self.connection.execute(
+        "INSERT INTO problems (id, rating, updated) VALUES (?, ?, ?) "
+        "ON CONFLICT (id) DO UPDATE SET rating = excluded.rating, updated = excluded.updated",
+        (problem_id, rating, updated)
+      )
+
+  # sets the ratings of existing problems from (id, rating, updated) tuples all at once
+  def update_ratings(self, records):
+    with self.connection:
+      self.connection.executemany(
+        "UPDATE problems SET rating = ?, updated = ? WHERE id = ?",
+        ((rating, updated, problem_id) for problem_id, rating, updated in records)
+      )
 
 
 def main():
-  global verbose, user_conf, problems_conf
-  # load or create conf files if they dont exist
-  if os.path.exists(USER_CONF_PATH):
-    user_conf = json.load(open(USER_CONF_PATH))
-  else:
-    user_conf = {
-      "solved": [],
-      "history": [],
-      "history_size": DEFAULT_HIST_SIZE,
-      "ids_last_updated": str(datetime.now()),
-      "ratings_update_period": 72
-    }
-  # should have been downloaded with katti
-  if os.path.exists(PROBLEMS_CONF_PATH):
-    problems_conf = json.load(open(PROBLEMS_CONF_PATH))
-  else:
-    print("Your problem ids JSON file appears to be corrupted")
-    print("Please download and install a new one at https://github.com/andrewjmcgehee/katti-automation")
-    print("Aborting...")
-    sys.exit(0)
+  global verbose
+  # load or create the user conf if it doesnt exist
+  load_user_conf()
   # add command line args
-  arg_parser = Parser(usage=usage_msg())
-  arg_parser.add_argument(
-    "-g",
-    "--get",
-    metavar="<problem-id>",
-    help="get a kattis problem by its problem id",
-    type=str,
-    choices=list(problems_conf.keys())
-  )
+  arg_parser = Parser(prog="katti", usage=usage_msg())
+  arg_parser.add_argument("-g", "--get", metavar="<problem-id>", nargs="+", help="get kattis problems by their problem ids", type=str)
+  arg_parser.add_argument("--get-file", dest="get_file", metavar="<path>", help="get every kattis problem listed in a file")
   arg_parser.add_argument("-r", "--run", help="run the test cases for a given problem", action="store_true")
+  arg_parser.add_argument("-j", "--jobs", metavar="<n>", help="number of test cases to run at once, defaults to cpu count", type=int)
+  arg_parser.add_argument("--limits", metavar=("<seconds>", "<megabytes>"), nargs=2, help="set the time and memory limits used when running the current problem's test cases")
+  arg_parser.add_argument("-c", "--compare", metavar="<mode>", help="compare outputs exactly (default), ignoring whitespace or as floats", choices=_comparison_modes, default="exact")
+  arg_parser.add_argument("--tolerance", metavar="<error>", help="absolute or relative error allowed by the float comparison", type=float, default=DEFAULT_TOLERANCE)
+  arg_parser.add_argument("--no-cache", dest="no_cache", help="always recompile instead of reusing a cached build", action="store_true")
+  arg_parser.add_argument("--watch", help="keep rerunning the test cases whenever the source or sample files change", action="store_true")
+  arg_parser.add_argument("--json", help="print test case measurements as JSON when running test cases", action="store_true")
   arg_parser.add_argument("-p", "--post", help="submit a kattis problem", action="store_true")
+  arg_parser.add_argument("--status", metavar="<submission-id>", help="resume tracking the result of a submission")
   arg_parser.add_argument("-v", "--verbose", help="receive verbose outputs", action="store_true")
   arg_parser.add_argument("-d", "--description", help="display a problem's description in chrome", action="store_true")
   arg_parser.add_argument("-b", "--default_browser", help="set the default browser to show problem descriptions", action="store_true")
   arg_parser.add_argument("--add", metavar="<problem_id", help="add a problem id to your problem config file")
-  arg_parser.add_argument("--random", metavar="<rating>", help="get a random kattis problem with a given rating")
+  arg_parser.add_argument("--random", metavar="<rating>", help="get a random kattis problem with a given rating, or within a range of ratings like 3.5-4.2")
   arg_parser.add_argument("--stats", help="get kattis stats if possible", action="store_true")
   arg_parser.add_argument("--history", help="see your 50 most recent kattis submissions", action="store_true")
   arg_parser.add_argument("--history_size", metavar="<size>", help="set history size with a number and query history size with -1")
   arg_parser.add_argument("--update_period", metavar="<hours>", help="set how frequently katti updates problem ratings in hours")
+  arg_parser.add_argument("--update_ratings", help="update every stale problem rating", action="store_true")
+  arg_parser.add_argument("--background", help="run --update_ratings in the background", action="store_true")
+  arg_parser.add_argument("--rate_limit", metavar="<requests>", help="set the maximum requests per second katti makes when updating problem ratings, 0 is unlimited")
+  arg_parser.add_argument("--background_refresh", metavar="<on|off>", help="set whether --stats and --random start a background rating update when one is due")
+  arg_parser.add_argument("--mirror_age", metavar="<hours>", help="set how many hours problems in the local mirror are used before they're fetched from kattis again")
+  arg_parser.add_argument("--mirror_export", metavar="<path>", help="write the local problem mirror to a zip file")
+  arg_parser.add_argument("--mirror_import", metavar="<path>", help="add the problems in a zip file written by --mirror_export to the local problem mirror")
   arg_parser.add_argument("--update_zsh_completions", help="update katti completions for zsh users", action="store_true")
   args = arg_parser.parse_args()
   # track verbosity
   verbose = args.verbose
+  # only pay for the problem ids and the network when a command uses them
+  if args.get_file:
+    args.get = (args.get or []) + read_problem_list(args.get_file)
+  if args.get or args.random or args.add or args.description or args.stats \
+     or args.update_ratings or args.update_zsh_completions:
+    load_problems_conf()
+  if args.get or args.random or args.post or args.status or args.add or args.stats \
+     or args.update_ratings:
+    import_requests()
+  if args.watch and not args.run:
+    arg_parser.error("argument --watch: only allowed with -r/--run")
+  if args.get:
+    invalid = [k for k in args.get if k not in problems_conf]
+    if invalid:
+      arg_parser.error("argument -g/--get: invalid option: %s" % ", ".join(invalid))
   # handle args passed in
   if args.get:
     get(args.get)
   elif args.random:
     get_random(args.random)
   elif args.run:
-    run()
+    run(args.jobs, args.json, args.compare, args.tolerance, not args.no_cache, args.watch)
   elif args.post:
     post()
+  elif args.status:
+    track_submission(args.status)
   elif args.add:
     add(args.add)
   elif args.default_browser:
@@ -1149,18 +3517,32 @@ def main():
     handle_history_size(args.history_size)
   elif args.update_period:
     set_update_period(args.update_period)
+  elif args.update_ratings:
+    if args.background:
+      start_background_refresh()
+    else:
+      get_updated_ratings()
+  elif args.rate_limit:
+    set_rate_limit(args.rate_limit)
+  elif args.background_refresh:
+    set_background_refresh(args.background_refresh)
+  elif args.limits:
+    set_limits(*args.limits)
+  elif args.mirror_age:
+    set_mirror_age(args.mirror_age)
+  elif args.mirror_export:
+    export_mirror(args.mirror_export)
+  elif args.mirror_import:
+    import_mirror(args.mirror_import)
   elif args.update_zsh_completions:
     update_zsh_completions()
   else:
     print("usage:", usage_msg())
-  # update conf files if needed
+  save_page_cache()
+  save_mirror()
+  # update the user conf if needed
   if modified:
-    with open(USER_CONF_PATH, mode="w") as f:
-      f.write(json.dumps(user_conf))
-      f.close()
-    with open(PROBLEMS_CONF_PATH, mode="w") as f:
-      f.write(json.dumps(problems_conf))
-      f.close()
+    save_user_conf()
 
 if __name__ == "__main__":
   main()